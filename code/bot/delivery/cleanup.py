@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from maxapi import Bot
+
+from interfaces.sessions import BaseSessionsManager
+from delivery.rate_limit import TokenBucket, call_with_retry, is_retryable
+
+
+logger = logging.getLogger(__name__)
+
+
+class SessionCleaner:
+    """
+    Deletes messages of finished sessions from chats in the background.
+
+    Messages stay in the sessions storage as pending deletion until the
+    Max API confirms they are gone. On start and then every
+    `claim_interval` seconds the cleaner claims those no replica holds
+    a lease on, so whatever a restarted or crashed replica left
+    unfinished is picked up by exactly one replica. Max API deletes one
+    message per request, so batching only applies to the storage side: each worker
+    takes up to `batch_size` queued messages and forgets them in one
+    transaction. Messages that still fail with a transient error after
+    `retries` are queued again after a backoff that doubles from
+    `retry_delay` up to `max_retry_delay` seconds.
+    """
+    def __init__(self, bot: Bot,
+                 session_manager: BaseSessionsManager,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 concurrency: int = 2,
+                 batch_size: int = 20,
+                 retries: int = 3,
+                 retry_delay: float = 5.0,
+                 max_retry_delay: float = 300.0,
+                 claim_interval: float = 60.0):
+        self.bot = bot
+        self.session_manager = session_manager
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.claim_interval = claim_interval
+        self._queue: asyncio.Queue[Tuple[int, str]] = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+        self._claimer: Optional[asyncio.Task] = None
+        # Сообщения, которые уже в очереди, в работе или ждут повтора,
+        # чтобы повторный захват не поставил их в очередь ещё раз
+        self._scheduled: Set[Tuple[int, str]] = set()
+        # Сколько раз сообщение уже откладывалось и таймеры повторов
+        self._failures: Dict[Tuple[int, str], int] = {}
+        self._retries: Dict[Tuple[int, str], asyncio.TimerHandle] = {}
+
+    async def start(self) -> None:
+        """Start workers and enqueue deletions left from a previous run."""
+        await self._claim()
+        self._workers = [asyncio.create_task(self._worker())
+                         for _ in range(self.concurrency)]
+        self._claimer = asyncio.create_task(self._claim_periodically())
+
+    async def stop(self) -> None:
+        """Stop workers. Unprocessed messages stay pending in storage."""
+        for handle in self._retries.values():
+            handle.cancel()
+        self._retries.clear()
+        tasks = self._workers + ([self._claimer] if self._claimer else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._claimer = None
+        self._queue = asyncio.Queue()
+        self._scheduled.clear()
+        self._failures.clear()
+
+    def schedule(self, chat_id: int, message_ids: List[str]) -> None:
+        """Queue messages of a finished session for deletion."""
+        for mid in message_ids:
+            self._enqueue((chat_id, mid))
+
+    def _enqueue(self, item: Tuple[int, str]) -> None:
+        if item not in self._scheduled:
+            self._scheduled.add(item)
+            self._queue.put_nowait(item)
+
+    async def _claim(self) -> None:
+        for item in await self.session_manager.claim_pending_deletions():
+            self._enqueue(item)
+
+    async def _claim_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.claim_interval)
+            try:
+                await self._claim()
+            except Exception as e:
+                logger.error("Failed to claim pending deletions: %s", e)
+
+    async def _delete(self, chat_id: int, mid: str) -> bool:
+        """Delete a message from the chat.
+        Returns False if it should stay pending for a later attempt."""
+        try:
+            await call_with_retry(lambda: self.bot.delete_message(mid),
+                                  rate_limiter=self.rate_limiter,
+                                  retries=self.retries)
+        except Exception as e:
+            if is_retryable(e):
+                logger.warning("Message %s in chat %s left pending: %s", mid, chat_id, e)
+                return False
+            # The message is already gone or can't be deleted at all,
+            # keeping it pending would only repeat the error
+            logger.error("Failed to delete message %s in chat %s: %s", mid, chat_id, e)
+        return True
+
+    def _retry_later(self, item: Tuple[int, str]) -> None:
+        """Queue a message that is still pending again after a backoff."""
+        failures = self._failures.get(item, 0)
+        self._failures[item] = failures + 1
+        delay = min(self.retry_delay * 2 ** failures, self.max_retry_delay)
+
+        def requeue():
+            self._retries.pop(item, None)
+            self._queue.put_nowait(item)
+
+        previous = self._retries.pop(item, None)
+        if previous is not None:
+            previous.cancel()
+        self._retries[item] = asyncio.get_running_loop().call_later(delay, requeue)
+
+    async def _worker(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                done = [item for item in batch if await self._delete(*item)]
+                await self.session_manager.remove_session_messages(done)
+            except Exception as e:
+                logger.error("Session cleanup batch failed: %s", e)
+                # Повторяется весь пакет: сообщение, уже удалённое из чата,
+                # при повторе получит неповторяемую ошибку и будет забыто
+                done = []
+            for item in batch:
+                if item in done:
+                    self._failures.pop(item, None)
+                    self._scheduled.discard(item)
+                else:
+                    self._retry_later(item)
+                self._queue.task_done()
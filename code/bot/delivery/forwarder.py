@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import weakref
+from typing import Awaitable, Callable, List, Optional
+
+from maxapi import Bot
+from maxapi.types import NewMessageLink
+from maxapi.enums.message_link_type import MessageLinkType
+from maxapi.methods.types.sended_message import SendedMessage
+
+from delivery.rate_limit import TokenBucket, call_with_retry
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageForwarder:
+    """
+    Forwards messages to chats, keeping their order in each chat.
+
+    Messages for one chat are sent strictly one after another, and
+    concurrent `forward` calls for the same chat wait for each other, so
+    a slow or retried request is never overtaken by the next message.
+    Up to `concurrency` chats are forwarded to in parallel. Every request
+    takes a token from the shared `rate_limiter`.
+    """
+    def __init__(self, bot: Bot,
+                 rate_limiter: Optional[TokenBucket] = None,
+                 concurrency: int = 4,
+                 retries: int = 3):
+        self.bot = bot
+        self.rate_limiter = rate_limiter
+        self.concurrency = concurrency
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # Замок чата живёт, пока в этот чат кто-то пересылает
+        self._chat_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = \
+            weakref.WeakValueDictionary()
+
+    async def _forward_one(self, chat_id: int, mid: str) -> Optional[str]:
+        link = NewMessageLink(type=MessageLinkType.FORWARD, mid=mid)
+        sent_msg = await call_with_retry(
+            lambda: self.bot.send_message(chat_id=chat_id, link=link),
+            rate_limiter=self.rate_limiter,
+            retries=self.retries)
+        if isinstance(sent_msg, SendedMessage):
+            return sent_msg.message.body.mid
+        return None
+
+    async def forward(self, chat_id: int, mids: List[str],
+                      on_sent: Optional[Callable[[str], Awaitable[None]]] = None
+                      ) -> List[Optional[str]]:
+        """
+        Forward messages `mids` to `chat_id` in the given order.
+
+        `on_sent` is awaited with the id of every sent message as soon as
+        it is delivered. Returns ids of sent messages in the order of
+        `mids`, with None for messages that could not be forwarded.
+        """
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = self._chat_locks[chat_id] = asyncio.Lock()
+        results: List[Optional[str]] = []
+        async with lock, self._semaphore:
+            for mid in mids:
+                sent_mid = None
+                try:
+                    sent_mid = await self._forward_one(chat_id, mid)
+                    if sent_mid is not None and on_sent is not None:
+                        await on_sent(sent_mid)
+                except Exception as e:
+                    logger.error("Failed to forward message %s to chat %s: %s",
+                                 mid, chat_id, e)
+                results.append(sent_mid)
+        return results
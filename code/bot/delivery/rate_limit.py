@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from maxapi.exceptions import MaxApiError, MaxConnection
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Max API answers 429 when the bot exceeds its request limit
+# and 5xx when the service is temporarily unavailable.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Token bucket limiter shared by everything that calls the Max API
+    on behalf of one bot. Waiters are served in FIFO order: each one
+    reserves its token right away and then sleeps until it is due.
+
+    Args:
+        rate (float): tokens added per second
+        capacity (int): maximum burst size, defaults to `rate`
+    """
+    def __init__(self, rate: float, capacity: Optional[int] = None):
+        if rate <= 0:
+            raise ValueError(f'Token bucket rate must be positive, got {rate}')
+        if capacity is not None and capacity < 1:
+            raise ValueError(f'Token bucket capacity must be at least 1, got {capacity}')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        # Токен резервируется сразу, баланс может уйти в минус на
+        # число ожидающих. Между пополнением и резервированием нет await,
+        # поэтому блокировка не нужна и спят ожидающие параллельно
+        self._refill()
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Check whether a failed Max API call is worth repeating."""
+    if isinstance(exc, MaxApiError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, (MaxConnection, asyncio.TimeoutError))
+
+
+async def call_with_retry(func: Callable[[], Awaitable[T]],
+                          rate_limiter: Optional[TokenBucket] = None,
+                          retries: int = 3,
+                          base_delay: float = 0.5) -> T:
+    """
+    Call `func`, repeating it with exponential backoff and jitter
+    while it fails with a transient Max API error.
+    Every attempt takes a token from `rate_limiter` if one is given.
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire()
+        try:
+            return await func()
+        except Exception as e:
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = base_delay * 2 ** attempt * (1 + random.random())
+            logger.warning("Max API call failed (%s), retry %d in %.2fs",
+                           e, attempt + 1, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ShardStats:
+    processed: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+class ChatShardedScheduler:
+    """
+    Runs `handler` for incoming updates on `shards` worker tasks.
+
+    Updates are assigned to a shard by chat id, so updates of one chat are
+    handled strictly one after another in arrival order, while different
+    chats proceed in parallel. Each shard queue holds at most `queue_size`
+    updates, `submit` waits for free space to push back on the producer.
+    """
+    def __init__(self, handler: Callable[[Any], Awaitable[None]],
+                 shards: int = 8,
+                 queue_size: int = 100):
+        self.handler = handler
+        self._queues: List[asyncio.Queue[Tuple[float, Any]]] = [
+            asyncio.Queue(maxsize=queue_size) for _ in range(shards)
+        ]
+        self._stats = [ShardStats() for _ in range(shards)]
+        self._workers: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker(i))
+                         for i in range(len(self._queues))]
+
+    async def stop(self) -> None:
+        """Finish queued updates and stop workers."""
+        await asyncio.gather(*(q.join() for q in self._queues))
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def submit(self, chat_id: int, event: Any) -> None:
+        """Queue an update for handling in its chat's shard."""
+        await self._queues[chat_id % len(self._queues)].put((time.monotonic(), event))
+
+    def stats(self) -> List[Dict[str, float]]:
+        """Return queue depth and wait time metrics for each shard."""
+        return [
+            {
+                'queue_depth': queue.qsize(),
+                'processed': stats.processed,
+                'avg_wait': stats.total_wait / stats.processed if stats.processed else 0.0,
+                'max_wait': stats.max_wait,
+            }
+            for queue, stats in zip(self._queues, self._stats)
+        ]
+
+    async def _worker(self, shard: int) -> None:
+        queue = self._queues[shard]
+        stats = self._stats[shard]
+        while True:
+            queued_at, event = await queue.get()
+            wait = time.monotonic() - queued_at
+            stats.processed += 1
+            stats.total_wait += wait
+            stats.max_wait = max(stats.max_wait, wait)
+            try:
+                await self.handler(event)
+            except Exception:
+                logger.exception("Failed to handle update in shard %d", shard)
+            finally:
+                queue.task_done()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from http import HTTPStatus
+from secrets import compare_digest
+from typing import Any, Callable, Dict, List, Optional
+
+from aiohttp import web
+from maxapi import Bot, Dispatcher
+from maxapi.webhook.aiohttp import AiohttpMaxWebhook
+
+
+logger = logging.getLogger(__name__)
+
+
+def _chat_id(event_json: dict[str, Any]) -> int:
+    """Chat id of a raw update, read without parsing it; 0 if it has none."""
+    recipient = (event_json.get('message') or {}).get('recipient') or {}
+    chat_id = recipient.get('chat_id')
+    if chat_id is None:
+        chat_id = event_json.get('chat_id')
+    if chat_id is None:
+        chat_id = (event_json.get('chat') or {}).get('chat_id')
+    return chat_id or 0
+
+
+class QueuedWebhook(AiohttpMaxWebhook):
+    """
+    Webhook endpoint that acknowledges an update as soon as it is queued
+    and lets `workers` tasks feed queued updates into the dispatcher.
+
+    Updates are queued to a worker by chat id on arrival, before anything
+    is awaited, so the updates of one chat reach the dispatcher, and the
+    `ChatShardedScheduler` behind it, in the order Max delivered them.
+
+    The queues hold at most `queue_size` updates. When a queue is full the
+    endpoint answers 503: Max treats any non-200 answer as a failed
+    delivery and repeats it later, so overload pushes back on the
+    platform instead of growing memory. `GET /health` reports the queue
+    depth for load balancer checks, along with whatever `metrics` returns.
+    """
+    def __init__(self, dp: Dispatcher, bot: Bot, *,
+                 secret: str | None = None,
+                 queue_size: int = 1000,
+                 workers: int = 16,
+                 metrics: Optional[Callable[[], Dict[str, Any]]] = None):
+        super().__init__(dp=dp, bot=bot, secret=secret)
+        self.workers = workers
+        self.metrics = metrics
+        self._queues: List[asyncio.Queue[dict[str, Any]]] = [
+            asyncio.Queue(maxsize=max(1, queue_size // workers)) for _ in range(workers)
+        ]
+        self._tasks: List[asyncio.Task] = []
+
+    async def on_startup(self, app: web.Application) -> None:
+        await super().on_startup(app)
+        self._tasks = [asyncio.create_task(self._worker(queue))
+                       for queue in self._queues]
+
+    async def on_cleanup(self, app: web.Application) -> None:
+        # Finish updates that were already acknowledged
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().on_cleanup(app)
+
+    def setup(self, app: web.Application, path: str = '/') -> None:
+        secret = self.secret
+
+        async def _webhook_handler(request: web.Request) -> web.Response:
+            if secret is not None:
+                incoming = request.headers.get("X-Max-Bot-Api-Secret")
+                if incoming is None or not compare_digest(incoming, secret):
+                    return web.Response(status=HTTPStatus.FORBIDDEN, text="Forbidden")
+            event_json = await request.json()
+            queue = self._queues[_chat_id(event_json) % len(self._queues)]
+            try:
+                queue.put_nowait(event_json)
+            except asyncio.QueueFull:
+                logger.warning("Update queue is full, asking Max to redeliver")
+                return web.Response(status=HTTPStatus.SERVICE_UNAVAILABLE, text="Busy")
+            return web.json_response({"ok": True})
+
+        async def _health_handler(request: web.Request) -> web.Response:
+            health = {"status": "healthy",
+                      "queue_depth": sum(queue.qsize() for queue in self._queues),
+                      "queue_size": sum(queue.maxsize for queue in self._queues)}
+            if self.metrics is not None:
+                health["metrics"] = self.metrics()
+            return web.json_response(health)
+
+        app.router.add_post(path, _webhook_handler)
+        app.router.add_get('/health', _health_handler)
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            event_json = await queue.get()
+            try:
+                await self._dispatch(event_json)
+            except Exception:
+                logger.exception("Failed to process update")
+            finally:
+                queue.task_done()
@@ -2,6 +2,16 @@ from abc import ABC, abstractmethod
 
 class BaseOCR(ABC):
     @abstractmethod
-    def get_transcription_by_url(self, image_url: str) -> str:
+    async def get_transcription_by_url(self, image_url: str) -> str:
         """Send image URL to OCR service and return extracted text."""
-        pass
\ No newline at end of file
+        pass
+
+    @abstractmethod
+    async def submit_job(self, image_url: str, priority: int = 0) -> str:
+        """Queue image URL for recognition and return the job id."""
+        pass
+
+    @abstractmethod
+    async def wait_for_job(self, job_id: str, timeout: float = 300) -> str:
+        """Wait for a recognition job to finish and return extracted text."""
+        pass
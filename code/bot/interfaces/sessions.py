@@ -3,11 +3,25 @@ from models import *
 
 class BaseSessionsManager(ABC):
     @abstractmethod
-    def update_session(self, chat_id: int, messages: List[str]) -> None:
+    async def update_session(self, user_id: int,
+                             chat_id: int, messages: List[str]) -> None:
         """Adds messages to a session"""
         pass
 
     @abstractmethod
-    def end_session(self, chat_id: int) -> List[str]:
-        """Ends session, deletes and returns messages from this session"""
+    async def end_session(self, chat_id: int) -> List[str]:
+        """Ends session, marks messages from this session
+        as pending deletion and returns them"""
+        pass
+
+    @abstractmethod
+    async def claim_pending_deletions(self) -> List[Tuple[int, str]]:
+        """Claims messages pending deletion that no other replica
+        is deleting and returns them as (chat_id, message_id)"""
+        pass
+
+    @abstractmethod
+    async def remove_session_messages(self, messages: List[Tuple[int, str]]) -> None:
+        """Forgets messages given as (chat_id, message_id)
+        once they are deleted from the chat"""
         pass
@@ -3,79 +3,116 @@ from models import *
 
 class BaseTagManager(ABC):
     @abstractmethod
-    def get_messages(self, user_id: int,
+    async def get_messages(self, user_id: int,
                       chat_id: int, tag: Tag) -> List[Message]:
         """Return a list of messages that have the given tag."""
         pass
 
     @abstractmethod
-    def get_messages_multitag(self, user_id: int,
+    async def get_messages_multitag(self, user_id: int,
                                chat_id: int, tags: List[Tag],
                                  tag_op: TagOperation) -> List[Message]:
         """Return a list of messages by multiple tags."""
         pass
 
     @abstractmethod
-    def add_tag(self, user_id: int, chat_id: int,
+    async def get_messages_page(self, user_id: int, chat_id: int,
+                                tags: List[Tag], tag_op: TagOperation,
+                                limit: int, cursor: Optional[str] = None) -> MessagePage:
+        """Return one page of messages by one or multiple tags,
+        ordered by message id and starting after `cursor`."""
+        pass
+
+    @abstractmethod
+    async def get_messages_page_by_query(self, user_id: int, chat_id: int,
+                                         query: TagQuery, limit: int,
+                                         cursor: Optional[str] = None) -> MessagePage:
+        """Return one page of messages matching a boolean tag query,
+        ordered by message id and starting after `cursor`."""
+        pass
+
+    @abstractmethod
+    async def add_tag(self, user_id: int, chat_id: int,
                  tag: Tag, message_id: str) -> None:
         """Add a tag to a specific message."""
         pass
 
     @abstractmethod
-    def add_tags(self, user_id: int, 
+    async def add_tags(self, user_id: int, 
                  chat_id: int, tags: List[Tag], message_id: str) -> None:
         """Add a list of tags to a specific message."""
         pass
 
     @abstractmethod
-    def add_tag_to_many(self, user_id: int, chat_id: int, tag: Tag,
-                         message_ids: List[str]) -> None:
-        """Add a tag to multiple messages."""
+    async def add_tag_to_many(self, user_id: int, chat_id: int, tag: Tag,
+                         message_ids: List[str]) -> List[Message]:
+        """Add a tag to multiple messages.
+        Returns messages that already had the tag instead of failing."""
         pass
 
     @abstractmethod
-    def add_tags_to_many(self, user_id: int, chat_id: int, 
-                         tags: List[Tag], message_ids: List[str]) -> None:
-        """Add the same list of tags to multiple messages."""
+    async def add_tags_to_many(self, user_id: int, chat_id: int, 
+                         tags: List[Tag], message_ids: List[str]) -> List[Message]:
+        """Add the same list of tags to multiple messages.
+        Returns messages with the tags they already had instead of failing."""
         pass
 
     @abstractmethod
-    def rename_tag(self, user_id: int, 
+    async def rename_tag(self, user_id: int, 
                    chat_id: int, old_tag: Tag, new_tag: Tag) -> None:
         """Rename an existing tag."""
         pass
 
     @abstractmethod
-    def reassign_tag(self, user_id: int, chat_id: int, 
+    async def reassign_tag(self, user_id: int, chat_id: int, 
                      message_id: str, old_tag: Tag, new_tag: Tag) -> None:
         """Replace a tag on a message with a new one."""
         pass
 
     @abstractmethod
-    def get_tags(self, user_id: int, chat_id: int) -> List[Tag]:
-        """Get all tags for a specific chat."""
+    async def get_tags(self, user_id: int, chat_id: int,
+                       order: Optional[TagOrder] = None) -> List[Tag]:
+        """Get all tags for a specific chat, optionally
+        most used or most recently used first."""
         pass
 
     @abstractmethod
-    def delete_tag(self, user_id: int, chat_id: int, tag: Tag) -> None:
+    async def delete_tag(self, user_id: int, chat_id: int, tag: Tag) -> None:
         """Delete a specific tag."""
         pass
 
     @abstractmethod
-    def get_message_tags(self, user_id: int,
+    async def get_message_tags(self, user_id: int,
                           chat_id: int, message_id: str) -> List[Tag]:
         """Get all tags associated with a specific message."""
         pass
 
     @abstractmethod
-    def remove_tag_from_message(self, user_id: int,
+    async def remove_tag_from_message(self, user_id: int,
                                  chat_id: int, tag: Tag, message_id: str) -> None:
         """Remove a specific tag from a specific message."""
         pass
 
     @abstractmethod
-    def delete_message(self, user_id: int,
+    async def delete_message(self, user_id: int,
                                  chat_id: int, message_id: str) -> None:
         """Delete a specific message from a specific chat 
         (with deleting of tags relations and orphan tags )."""
         pass
+
+    @abstractmethod
+    async def save_message_text(self, user_id: int, chat_id: int, message_id: str,
+                                text: str, source: str) -> None:
+        """Store searchable text of a message, replacing the previous
+        text from the same `source`."""
+        pass
+
+    @abstractmethod
+    async def search_messages(self, user_id: int, query: str, limit: int = 10,
+                              chat_id: Optional[int] = None,
+                              tags: Optional[List[Tag]] = None,
+                              tag_op: TagOperation = TagOperation.AND) -> List[Message]:
+        """Return messages from the user's chats whose text matches `query`,
+        best matches first. With `chat_id` only that chat is searched and
+        `tags` further limit the result to messages having them."""
+        pass
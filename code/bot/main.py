@@ -11,8 +11,16 @@ from ui.tag_bot import build_ui, TagBotUI
 from sql_adapters.tags import SQLTagManager
 from sql_adapters.chats import SQLChatManager
 from sql_adapters.sessions import SQLSessionManager
-from sql_adapters.db import init_db
+from sql_adapters.db import init_db, pool_stats
+from sql_adapters.unit_of_work import UnitOfWork, outside_transaction
+from sql_adapters.membership_cache import MembershipCache
 from ocr_http_adapter.ocr import httpOCR
+from delivery.rate_limit import TokenBucket
+from delivery.forwarder import MessageForwarder
+from delivery.cleanup import SessionCleaner
+from ingest.webhook import QueuedWebhook
+from ingest.scheduler import ChatShardedScheduler
+from metrics import MetricsReporter
 
 
 logging.basicConfig(level=logging.INFO)
@@ -24,7 +32,11 @@ bot = Bot(token)
 dp = Dispatcher()
 
 ui: TagBotUI
+sess_maker = None
 session_manager: SQLSessionManager
+session_cleaner: SessionCleaner
+scheduler: ChatShardedScheduler
+metrics: MetricsReporter
 
 
 @dp.bot_started()
@@ -37,51 +49,133 @@ async def hello(event: BotStarted):
 
 @dp.message_created()
 async def message_created(event: MessageCreated):
-    await message_handler(event)
+    await scheduler.submit(event.get_ids()[0], event)
 
 
 @dp.message_callback()
 async def message_callback(event: MessageCallback):
-    await message_handler(event)
+    await scheduler.submit(event.get_ids()[0], event)
 
 
 async def message_handler(event):
-    # End previous session before ui.respond (it can send new messages to the current session)
-    prev_sess_messages = session_manager.end_session(event.get_ids()[0])
-
-    if isinstance(event, MessageCreated):
-        route_name, args = ui.extract_message_created_payload(event)
-    elif isinstance(event, MessageCallback):
-        route_name, args = ui.extract_message_callback_payload(event)
-    
-    if route_name is not None:
-        response = await ui.respond(event, route_name, args)
-        sent_message: SendedMessage = await event.message.answer(**response)
-
-        if isinstance(sent_message, SendedMessage):
-            chat_id, user_id = event.get_ids()
-            session_manager.update_session(user_id, chat_id, [sent_message.message.body.mid])
-
-        # Clear previous session.
-        # This is done after sending the response for a smoother chat interaction.
-        for mid in prev_sess_messages:
-            await bot.delete_message(mid)
+    prev_sess_messages = []
+    try:
+        # Reads and writes of the managers for this update share a transaction,
+        # committed before each network call and before the previous session
+        # is scheduled for cleanup
+        async with UnitOfWork(sess_maker):
+            # End previous session before ui.respond (it can send new messages to the current session)
+            prev_sess_messages = await session_manager.end_session(event.get_ids()[0])
+
+            if isinstance(event, MessageCreated):
+                route_name, args = ui.extract_message_created_payload(event)
+            elif isinstance(event, MessageCallback):
+                route_name, args = ui.extract_message_callback_payload(event)
+
+            if route_name is not None:
+                response = await ui.respond(event, route_name, args)
+                async with outside_transaction():
+                    sent_message: SendedMessage = await event.message.answer(**response)
+
+                if isinstance(sent_message, SendedMessage):
+                    chat_id, user_id = event.get_ids()
+                    await session_manager.update_session(user_id, chat_id, [sent_message.message.body.mid])
+                    await ui.after_send(event, route_name, args, sent_message)
+    finally:
+        # Clear previous session in the background.
+        # Scheduled after sending the response for a smoother chat interaction.
+        session_cleaner.schedule(event.get_ids()[0], prev_sess_messages)
 
 
 async def main():
-    await dp.start_polling(bot)
-
-
-if __name__ == '__main__':
-    sess_maker = init_db(os.getenv('DB_CONNECTION_STRING'))
-    chat_manager = SQLChatManager(sess_maker)
-    tag_manager = SQLTagManager(sess_maker)
-    session_manager = SQLSessionManager(sess_maker)
-    ocr_client = httpOCR(os.getenv('OCR_BASE_URL'))
+    global ui, sess_maker, session_manager, session_cleaner, scheduler, metrics
+
+    # The engine is bound to the running event loop, so storage
+    # is initialized here rather than at import time.
+    statement_timeout = float(os.getenv('DB_STATEMENT_TIMEOUT', '0'))
+    idle_in_transaction_timeout = float(os.getenv('DB_IDLE_IN_TRANSACTION_TIMEOUT', '60'))
+    slow_query_threshold = float(os.getenv('DB_SLOW_QUERY_THRESHOLD', '0.5'))
+    sess_maker = await init_db(
+        os.getenv('DB_CONNECTION_STRING'),
+        pool_size=int(os.getenv('DB_POOL_SIZE', '5')),
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', '10')),
+        pool_timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+        pool_recycle=float(os.getenv('DB_POOL_RECYCLE', '1800')),
+        pool_pre_ping=os.getenv('DB_POOL_PRE_PING', '1') == '1',
+        statement_timeout=statement_timeout or None,
+        idle_in_transaction_timeout=idle_in_transaction_timeout or None,
+        slow_query_threshold=slow_query_threshold or None)
+    # Shared by all managers so that SQLChatManager can invalidate
+    # memberships the other managers have cached.
+    membership_cache = MembershipCache(
+        max_size=int(os.getenv('MEMBERSHIP_CACHE_SIZE', '10000')),
+        ttl=float(os.getenv('MEMBERSHIP_CACHE_TTL', '300')))
+    chat_manager = SQLChatManager(sess_maker, membership_cache)
+    tag_manager = SQLTagManager(sess_maker, membership_cache)
+    session_manager = SQLSessionManager(sess_maker, membership_cache,
+                                        deletion_lease=float(os.getenv('CLEANUP_LEASE', '600')))
+    ocr_client = httpOCR(os.getenv('OCR_BASE_URL'),
+                         max_concurrency=int(os.getenv('OCR_MAX_CONCURRENCY', '4')),
+                         timeout=float(os.getenv('OCR_TIMEOUT', '60')))
+    # One bucket for all outgoing Max API calls of this bot
+    rate_limiter = TokenBucket(rate=float(os.getenv('MAX_API_RPS', '30')))
+    # Messages go to each chat one by one, in order; chats are served in parallel
+    forwarder = MessageForwarder(bot,
+                                 rate_limiter=rate_limiter,
+                                 concurrency=int(os.getenv('FORWARD_CONCURRENCY', '4')))
+    session_cleaner = SessionCleaner(bot, session_manager,
+                                     rate_limiter=rate_limiter,
+                                     concurrency=int(os.getenv('CLEANUP_CONCURRENCY', '2')),
+                                     claim_interval=float(os.getenv('CLEANUP_CLAIM_INTERVAL', '60')))
     ui = build_ui(tag_manager=tag_manager,
                   chat_manager=chat_manager,
                   session_manager=session_manager,
                   ocr_client=ocr_client,
+                  forwarder=forwarder,
                   bot=bot)
 
+    # Updates of one chat are handled in order, different chats in parallel
+    scheduler = ChatShardedScheduler(message_handler,
+                                     shards=int(os.getenv('UPDATE_SHARDS', '8')),
+                                     queue_size=int(os.getenv('UPDATE_SHARD_QUEUE_SIZE', '100')))
+
+    # Logged every METRICS_LOG_INTERVAL seconds (0 disables) and served on /health
+    metrics = MetricsReporter(interval=float(os.getenv('METRICS_LOG_INTERVAL', '60')))
+    metrics.add_source('db_pool', lambda: pool_stats(sess_maker))
+    metrics.add_source('scheduler', scheduler.stats)
+    metrics.add_source('membership_cache', membership_cache.stats)
+
+    await session_cleaner.start()
+    await scheduler.start()
+    await metrics.start()
+    try:
+        if os.getenv('BOT_MODE', 'polling') == 'webhook':
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await metrics.stop()
+        await scheduler.stop()
+        await session_cleaner.stop()
+        await ocr_client.close()
+
+
+async def run_webhook():
+    secret = os.getenv('WEBHOOK_SECRET')
+    webhook = QueuedWebhook(dp, bot,
+                            secret=secret,
+                            queue_size=int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+                            workers=int(os.getenv('WEBHOOK_WORKERS', '16')),
+                            metrics=metrics.collect)
+    # With several replicas behind a load balancer the public URL
+    # only needs to be subscribed once, so it is optional here.
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        await bot.subscribe_webhook(webhook_url, secret=secret)
+    await webhook.run(host='0.0.0.0',
+                      port=int(os.getenv('WEBHOOK_PORT', '5234')),
+                      path=os.getenv('WEBHOOK_PATH', '/webhook'))
+
+
+if __name__ == '__main__':
     asyncio.run(main())
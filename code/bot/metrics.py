@@ -0,0 +1,46 @@
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsReporter:
+    """
+    Collects `stats()` of bot components under their names. `start` logs
+    them every `interval` seconds, and the webhook serves them on /health.
+    """
+    def __init__(self, interval: float = 60.0):
+        self.interval = interval
+        self._sources: Dict[str, Callable[[], Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def add_source(self, name: str, stats: Callable[[], Any]) -> None:
+        self._sources[name] = stats
+
+    def collect(self) -> Dict[str, Any]:
+        """Return current metrics of all sources."""
+        metrics = {}
+        for name, stats in self._sources.items():
+            try:
+                metrics[name] = stats()
+            except Exception as e:
+                metrics[name] = {'error': str(e)}
+        return metrics
+
+    async def start(self) -> None:
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            logger.info("Metrics: %s", json.dumps(self.collect()))
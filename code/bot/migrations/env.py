@@ -0,0 +1,40 @@
+import asyncio
+import os
+
+from alembic import context
+from sqlalchemy import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from sql_adapters.models import Base
+
+
+config = context.config
+target_metadata = Base.metadata
+
+
+def include_object(object, name, type_, reflected, compare_to) -> bool:
+    # FTS5 tables of message_text are not models, migration 0003 creates them
+    return not (type_ == 'table' and name.startswith('message_text_fts'))
+
+
+def run_with_connection(connection: Connection) -> None:
+    context.configure(connection=connection, target_metadata=target_metadata,
+                      include_object=include_object,
+                      transaction_per_migration=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_with_engine() -> None:
+    engine = create_async_engine(os.environ['DB_CONNECTION_STRING'])
+    async with engine.connect() as connection:
+        await connection.run_sync(run_with_connection)
+    await engine.dispose()
+
+
+# init_db passes its own connection, the alembic CLI connects by itself
+connection = config.attributes.get('connection')
+if connection is not None:
+    run_with_connection(connection)
+else:
+    asyncio.run(run_with_engine())
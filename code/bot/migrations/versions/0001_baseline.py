@@ -0,0 +1,56 @@
+"""Schema as it was created by create_all before migrations
+
+Revision ID: 0001
+Revises:
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'chat',
+        sa.Column('id', sa.BigInteger(), primary_key=True),
+        sa.Column('name', sa.String(255), nullable=True),
+    )
+    op.create_table(
+        'user_chat',
+        sa.Column('user_id', sa.BigInteger(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('is_main', sa.Boolean(), nullable=False),
+    )
+    op.create_table(
+        'tag',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  primary_key=True),
+    )
+    op.create_table(
+        'message_tag',
+        sa.Column('message_id', sa.String(), primary_key=True),
+        sa.Column('tag_name', sa.String(), primary_key=True),
+        sa.Column('tag_chat_id', sa.BigInteger(), primary_key=True),
+        sa.ForeignKeyConstraint(['tag_name', 'tag_chat_id'], ['tag.name', 'tag.chat_id'],
+                                ondelete='CASCADE'),
+    )
+    op.create_table(
+        'chat_session_messages',
+        sa.Column('message_id', sa.String(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  primary_key=True),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('chat_session_messages')
+    op.drop_table('message_tag')
+    op.drop_table('tag')
+    op.drop_table('user_chat')
+    op.drop_table('chat')
@@ -0,0 +1,30 @@
+"""Keep messages of finished sessions until they are deleted from the chat
+
+This is the schema step of the change that added the column to the
+model. Before migrations existed create_all never added it to existing
+tables; on databases where it was added by hand it is kept as is.
+
+Revision ID: 0002
+Revises: 0001
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('chat_session_messages')}
+    if 'pending_deletion' in columns:
+        return
+    op.add_column('chat_session_messages',
+                  sa.Column('pending_deletion', sa.Boolean(),
+                            server_default=sa.false(), nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('chat_session_messages', 'pending_deletion')
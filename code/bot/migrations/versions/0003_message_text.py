@@ -0,0 +1,58 @@
+"""Searchable message text with a full-text index
+
+Before migrations existed create_all made the table, and the index with
+it, on the first start after the model was added. Such databases are
+stamped as the baseline, so what is already there is kept.
+
+Revision ID: 0003
+Revises: 0002
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table('message_text'):
+        _create_index()
+        return
+    op.create_table(
+        'message_text',
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('message_id', sa.String(), primary_key=True),
+        sa.Column('source', sa.String(16), primary_key=True),
+        sa.Column('text', sa.Text(), nullable=False),
+    )
+    _create_index()
+
+
+def _create_index() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        # External content FTS5 table: holds only the index, triggers keep it in sync
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS message_text_fts "
+                   "USING fts5(text, content='message_text', content_rowid='rowid')")
+        op.execute("CREATE TRIGGER IF NOT EXISTS message_text_ai AFTER INSERT ON message_text BEGIN "
+                   "INSERT INTO message_text_fts (rowid, text) VALUES (new.rowid, new.text); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS message_text_ad AFTER DELETE ON message_text BEGIN "
+                   "INSERT INTO message_text_fts (message_text_fts, rowid, text) "
+                   "VALUES ('delete', old.rowid, old.text); END")
+        op.execute("CREATE TRIGGER IF NOT EXISTS message_text_au AFTER UPDATE ON message_text BEGIN "
+                   "INSERT INTO message_text_fts (message_text_fts, rowid, text) "
+                   "VALUES ('delete', old.rowid, old.text); "
+                   "INSERT INTO message_text_fts (rowid, text) VALUES (new.rowid, new.text); END")
+    else:
+        # Must match MESSAGE_TEXT_TSVECTOR used by the search queries
+        op.execute("CREATE INDEX IF NOT EXISTS ix_message_text_fts ON message_text USING GIN "
+                   "((to_tsvector('russian', text) || to_tsvector('english', text)))")
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE message_text_fts")
+    op.drop_table('message_text')
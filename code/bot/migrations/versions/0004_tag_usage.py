@@ -0,0 +1,37 @@
+"""Tag usage counters
+
+This is the schema step of the change that added the columns to the
+model. Before migrations existed create_all never added them to existing
+tables; where they were added by hand they are kept, and the counters
+are refilled either way.
+
+Revision ID: 0004
+Revises: 0003
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    columns = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('tag')}
+    if 'usage_count' not in columns:
+        op.add_column('tag', sa.Column('usage_count', sa.Integer(),
+                                       server_default='0', nullable=False))
+    if 'last_used_at' not in columns:
+        op.add_column('tag', sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True))
+    # Счётчики существующих тегов заполняются по текущим связям
+    op.execute("UPDATE tag SET usage_count = ("
+               "SELECT count(*) FROM message_tag "
+               "WHERE message_tag.tag_name = tag.name "
+               "AND message_tag.tag_chat_id = tag.chat_id)")
+
+
+def downgrade() -> None:
+    op.drop_column('tag', 'last_used_at')
+    op.drop_column('tag', 'usage_count')
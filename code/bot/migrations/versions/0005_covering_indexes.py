@@ -0,0 +1,29 @@
+"""Covering indexes for tag and membership lookups
+
+Revision ID: 0005
+Revises: 0004
+"""
+from alembic import op
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Messages by tag: get_messages, pages and tag queries
+    op.create_index('ix_message_tag_chat_tag_message', 'message_tag',
+                    ['tag_chat_id', 'tag_name', 'message_id'])
+    # Tags of a message: get_message_tags, delete_message
+    op.create_index('ix_message_tag_chat_message', 'message_tag',
+                    ['tag_chat_id', 'message_id'], postgresql_include=['tag_name'])
+    # Chats of a user: get_main_chat, get_ext_chats, search
+    op.create_index('ix_user_chat_user_main', 'user_chat', ['user_id', 'is_main'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_user_chat_user_main', 'user_chat')
+    op.drop_index('ix_message_tag_chat_message', 'message_tag')
+    op.drop_index('ix_message_tag_chat_tag_message', 'message_tag')
@@ -0,0 +1,166 @@
+"""Integer ids for tags, message_tag references tags by id
+
+Revision ID: 0006
+Revises: 0005
+
+On PostgreSQL message_tag keeps serving the old schema while tag ids
+are backfilled in small batches, the new indexes are built concurrently
+and NOT NULL is proven by a validated CHECK constraint. The swap of keys
+then holds ACCESS EXCLUSIVE locks only for catalog changes, without
+scanning or indexing message_tag, and the new foreign key is validated
+after that in a transaction of its own, which doesn't block writes.
+Adding the identity column rewrites `tag` under a lock, which is cheap
+next to message_tag. SQLite tables are simply rebuilt.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'sqlite':
+        _rebuild_tables()
+        return
+
+    op.add_column('tag', sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False))
+    op.add_column('message_tag', sa.Column('tag_id', sa.BigInteger(), nullable=True))
+    # Пока идёт заполнение, новые связи от старого кода получают tag_id сразу
+    op.execute("""
+        CREATE FUNCTION message_tag_set_tag_id() RETURNS trigger AS $$
+        BEGIN
+            NEW.tag_id := (SELECT id FROM tag
+                           WHERE name = NEW.tag_name AND chat_id = NEW.tag_chat_id);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("CREATE TRIGGER message_tag_set_tag_id "
+               "BEFORE INSERT OR UPDATE OF tag_name, tag_chat_id ON message_tag "
+               "FOR EACH ROW EXECUTE FUNCTION message_tag_set_tag_id()")
+
+    with op.get_context().autocommit_block():
+        # Каждая пачка коммитится отдельно и блокирует только свои строки
+        while True:
+            updated = op.get_bind().execute(sa.text(
+                "UPDATE message_tag SET tag_id = tag.id FROM tag "
+                "WHERE tag.name = message_tag.tag_name "
+                "AND tag.chat_id = message_tag.tag_chat_id "
+                "AND message_tag.ctid IN ("
+                "SELECT ctid FROM message_tag WHERE tag_id IS NULL LIMIT :batch_size)"
+            ), {'batch_size': BACKFILL_BATCH_SIZE}).rowcount
+            if updated == 0:
+                break
+        # Связи с несуществующими тегами заполнить нечем
+        op.execute("DELETE FROM message_tag WHERE tag_id IS NULL")
+        # Проверенный CHECK избавляет SET NOT NULL в PRIMARY KEY от полного
+        # скана под блокировкой; VALIDATE не блокирует запись
+        op.execute("ALTER TABLE message_tag ADD CONSTRAINT message_tag_tag_id_not_null "
+                   "CHECK (tag_id IS NOT NULL) NOT VALID")
+        op.execute("ALTER TABLE message_tag VALIDATE CONSTRAINT message_tag_tag_id_not_null")
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS message_tag_tag_message "
+                   "ON message_tag (tag_id, message_id)")
+        op.execute("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_message_tag_message "
+                   "ON message_tag (message_id, tag_id)")
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS tag_id_key ON tag (id)")
+        op.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS uq_tag_chat_name "
+                   "ON tag (chat_id, name)")
+
+    # Переключение ключей: только изменения каталога, без сканов таблиц
+    inspector = sa.inspect(op.get_bind())
+    tag_pk = inspector.get_pk_constraint('tag')['name']
+    message_tag_pk = inspector.get_pk_constraint('message_tag')['name']
+    message_tag_fks = [fk['name'] for fk in inspector.get_foreign_keys('message_tag')]
+
+    op.execute("DROP TRIGGER message_tag_set_tag_id ON message_tag")
+    op.execute("DROP FUNCTION message_tag_set_tag_id()")
+    for fk in message_tag_fks:
+        op.drop_constraint(fk, 'message_tag', type_='foreignkey')
+    op.drop_constraint(message_tag_pk, 'message_tag', type_='primary')
+    op.drop_index('ix_message_tag_chat_tag_message', 'message_tag')
+    op.drop_index('ix_message_tag_chat_message', 'message_tag')
+    op.execute("ALTER TABLE message_tag ADD CONSTRAINT message_tag_pkey "
+               "PRIMARY KEY USING INDEX message_tag_tag_message")
+    op.drop_constraint('message_tag_tag_id_not_null', 'message_tag', type_='check')
+    op.drop_column('message_tag', 'tag_name')
+    op.drop_column('message_tag', 'tag_chat_id')
+
+    op.drop_constraint(tag_pk, 'tag', type_='primary')
+    op.execute("ALTER TABLE tag ADD CONSTRAINT tag_pkey PRIMARY KEY USING INDEX tag_id_key")
+    op.execute("ALTER TABLE tag ADD CONSTRAINT uq_tag_chat_name UNIQUE USING INDEX uq_tag_chat_name")
+    # NOT VALID проверяет только новые строки и не сканирует таблицу
+    op.execute("ALTER TABLE message_tag ADD CONSTRAINT message_tag_tag_id_fkey "
+               "FOREIGN KEY (tag_id) REFERENCES tag (id) ON DELETE CASCADE NOT VALID")
+
+    # Существующие строки проверяются уже после коммита переключения:
+    # VALIDATE берёт SHARE UPDATE EXCLUSIVE и не мешает записи
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TABLE message_tag VALIDATE CONSTRAINT message_tag_tag_id_fkey")
+
+
+def _rebuild_tables() -> None:
+    op.create_table(
+        'tag_new',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('usage_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True),
+        sa.UniqueConstraint('chat_id', 'name', name='uq_tag_chat_name'),
+    )
+    op.execute("INSERT INTO tag_new (name, chat_id, usage_count, last_used_at) "
+               "SELECT name, chat_id, usage_count, last_used_at FROM tag")
+    op.create_table(
+        'message_tag_new',
+        sa.Column('tag_id', sa.Integer(), sa.ForeignKey('tag.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('message_id', sa.String(), primary_key=True),
+    )
+    op.execute("INSERT INTO message_tag_new (tag_id, message_id) "
+               "SELECT tag_new.id, message_tag.message_id FROM message_tag "
+               "JOIN tag_new ON tag_new.name = message_tag.tag_name "
+               "AND tag_new.chat_id = message_tag.tag_chat_id")
+    op.drop_table('message_tag')
+    op.drop_table('tag')
+    op.rename_table('tag_new', 'tag')
+    op.rename_table('message_tag_new', 'message_tag')
+    op.create_index('ix_message_tag_message', 'message_tag', ['message_id', 'tag_id'])
+
+
+def downgrade() -> None:
+    op.create_table(
+        'tag_old',
+        sa.Column('name', sa.String(), primary_key=True),
+        sa.Column('chat_id', sa.BigInteger(), sa.ForeignKey('chat.id', ondelete='CASCADE'),
+                  primary_key=True),
+        sa.Column('usage_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('last_used_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.execute("INSERT INTO tag_old (name, chat_id, usage_count, last_used_at) "
+               "SELECT name, chat_id, usage_count, last_used_at FROM tag")
+    op.create_table(
+        'message_tag_old',
+        sa.Column('message_id', sa.String(), primary_key=True),
+        sa.Column('tag_name', sa.String(), primary_key=True),
+        sa.Column('tag_chat_id', sa.BigInteger(), primary_key=True),
+        sa.ForeignKeyConstraint(['tag_name', 'tag_chat_id'], ['tag.name', 'tag.chat_id'],
+                                ondelete='CASCADE'),
+    )
+    op.execute("INSERT INTO message_tag_old (message_id, tag_name, tag_chat_id) "
+               "SELECT message_tag.message_id, tag.name, tag.chat_id FROM message_tag "
+               "JOIN tag ON tag.id = message_tag.tag_id")
+    op.drop_table('message_tag')
+    op.drop_table('tag')
+    op.rename_table('tag_old', 'tag')
+    op.rename_table('message_tag_old', 'message_tag')
+    op.create_index('ix_message_tag_chat_tag_message', 'message_tag',
+                    ['tag_chat_id', 'tag_name', 'message_id'])
+    op.create_index('ix_message_tag_chat_message', 'message_tag',
+                    ['tag_chat_id', 'message_id'], postgresql_include=['tag_name'])
@@ -0,0 +1,34 @@
+"""Indexes led by chat_id for memberships and session messages
+
+Revision ID: 0007
+Revises: 0006
+"""
+from alembic import op
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def _create_indexes(**kw) -> None:
+    # Users of a chat: get_chat_users (the primary key starts with user_id)
+    op.create_index('ix_user_chat_chat', 'user_chat', ['chat_id', 'user_id'], **kw)
+    # Session of a chat: end_session, update_session
+    op.create_index('ix_chat_session_messages_chat', 'chat_session_messages',
+                    ['chat_id', 'pending_deletion'], **kw)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # Индексы строятся без блокировки записи в таблицы
+        with op.get_context().autocommit_block():
+            _create_indexes(postgresql_concurrently=True, if_not_exists=True)
+    else:
+        _create_indexes()
+
+
+def downgrade() -> None:
+    op.drop_index('ix_chat_session_messages_chat', 'chat_session_messages')
+    op.drop_index('ix_user_chat_chat', 'user_chat')
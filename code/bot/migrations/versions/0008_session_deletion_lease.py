@@ -0,0 +1,22 @@
+"""Lease on messages pending deletion, so replicas don't delete the same ones
+
+Revision ID: 0008
+Revises: 0007
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('chat_session_messages',
+                  sa.Column('deletion_lease_until', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('chat_session_messages', 'deletion_lease_until')
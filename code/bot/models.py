@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, Optional, Tuple, Union
 from dataclasses import dataclass, field
 from enum import Enum
 
@@ -12,6 +12,10 @@ class TagOperation(Enum):
     AND = "AND"
     OR = "OR"
 
+class TagOrder(Enum):
+    FREQUENCY = "frequency"
+    RECENCY = "recency"
+
 @dataclass
 class Tag:
     name: str
@@ -21,4 +25,26 @@ class Message:
     message_id: str
     chat_id: int
     sender_id: Optional[int] = None
-    tags: List[Tag] = field(default_factory=list)
\ No newline at end of file
+    tags: List[Tag] = field(default_factory=list)
+
+@dataclass
+class MessagePage:
+    messages: List[Message]
+    total: int
+    next_cursor: Optional[str] = None
+
+# Логическое выражение над тегами, например work & (urgent | todo) & !done
+@dataclass
+class TagTerm:
+    tag: Tag
+
+@dataclass
+class TagNot:
+    operand: 'TagQuery'
+
+@dataclass
+class TagGroup:
+    op: TagOperation
+    operands: List['TagQuery']
+
+TagQuery = Union[TagTerm, TagNot, TagGroup]
@@ -0,0 +1,48 @@
+import time
+
+
+class CircuitOpenError(Exception):
+    """Indicates that a call was rejected because the circuit is open."""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing service for `reset_timeout` seconds after
+    `failure_threshold` consecutive failures. Once the timeout passes a
+    single trial call is let through: success closes the circuit,
+    failure opens it again.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_in_progress = False
+
+    def allow(self) -> bool:
+        """Check whether a call may be made now."""
+        if self._opened_at is None:
+            return True
+        if self._trial_in_progress:
+            return False
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_progress = False
+
+    def release(self) -> None:
+        """End a call that tells nothing about the service, e.g. a cancelled
+        one, so that a trial call doesn't keep the circuit open for good."""
+        self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_progress = False
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
@@ -1,20 +1,99 @@
-import requests
+import asyncio
+
+import aiohttp
 
 from interfaces.ocr import BaseOCR
+from ocr_http_adapter.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 
 class httpOCR(BaseOCR):
-    def __init__(self, base_url: str):
+    """
+    OCR service client over a persistent keep-alive connection pool.
+
+    At most `max_concurrency` requests are in flight, the rest wait
+    for a free slot. Network errors, timeouts, 5xx answers and bodies
+    that are not JSON count as failures for the circuit breaker, which
+    then rejects calls at once instead of letting every user wait for
+    the timeout.
+    """
+    def __init__(self, base_url: str,
+                 max_concurrency: int = 4,
+                 timeout: float = 60,
+                 connect_timeout: float = 5,
+                 breaker: CircuitBreaker | None = None):
         self.base_url = base_url
+        self.max_concurrency = max_concurrency
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily: aiohttp sessions must be created inside the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency,
+                                             keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=self.timeout)
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
 
-    def get_transcription_by_url(self, image_url: str) -> str:
+    async def _request(self, method: str, path: str, expected_status: int = 200,
+                       json: dict | None = None) -> dict:
+        if not self.breaker.allow():
+            raise CircuitOpenError("OCR service is unavailable")
+
+        # None if the call tells nothing about the service: it was
+        # cancelled or failed on our side
+        failed: bool | None = None
+        try:
+            async with self._semaphore:
+                async with self._get_session().request(method, f"{self.base_url}{path}",
+                                                       json=json) as response:
+                    if response.status != expected_status:
+                        # 4xx means a bad request, the service itself is up
+                        failed = response.status >= 500
+                        raise Exception(f"OCR service error: {await response.text()}")
+                    body = await response.json()
+                    failed = False
+                    return body
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            # Network errors, timeouts and bodies that are not JSON
+            failed = True
+            raise
+        finally:
+            if failed is None:
+                self.breaker.release()
+            elif failed:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
+    async def get_transcription_by_url(self, image_url: str) -> str:
         """Send image URL to OCR service and return extracted text."""
-        response = requests.post(f"{self.base_url}/ocr",
-                                 json={"image": image_url},
-                                 timeout=60)
-
-        if response.status_code != 200:
-            raise Exception(f"OCR service error: {response.text}")
-        
-        data = response.json()
-        return data.get("text", "")
\ No newline at end of file
+        data = await self._request("POST", "/ocr", json={"image": image_url})
+        return data.get("text", "")
+
+    async def submit_job(self, image_url: str, priority: int = 0) -> str:
+        """Queue image URL for recognition and return the job id."""
+        data = await self._request("POST", "/jobs", expected_status=202,
+                                   json={"image": image_url, "priority": priority})
+        return data["id"]
+
+    async def wait_for_job(self, job_id: str, timeout: float = 300) -> str:
+        """Poll a job until it finishes and return extracted text."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        poll_interval = 0.5
+        while True:
+            job = await self._request("GET", f"/jobs/{job_id}")
+            if job["status"] == "done":
+                return job.get("text", "")
+            if job["status"] == "failed":
+                raise Exception(f"OCR job failed: {job.get('error')}")
+            if asyncio.get_running_loop().time() + poll_interval > deadline:
+                raise asyncio.TimeoutError(f"OCR job {job_id} is not finished")
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 1.5, 3)
@@ -1,33 +1,49 @@
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from exceptions import AlreadyExistsException, NotFoundException
-from contextlib import contextmanager
+from contextlib import asynccontextmanager
 from typing import List, Optional
 
 from models import Chat
 from interfaces.chats import BaseChatManager
 from sql_adapters.models import DbUserChat, DbChat
+from sql_adapters.membership_cache import MembershipCache
+from sql_adapters.instrumentation import db_operation
+from sql_adapters.unit_of_work import after_commit, current_unit_of_work
 
 
 class SQLChatManager(BaseChatManager):
-    def __init__(self, sess_maker: sessionmaker):
+    def __init__(self, sess_maker: async_sessionmaker,
+                 membership_cache: Optional[MembershipCache] = None):
         self.sess_maker = sess_maker
+        self.membership_cache = membership_cache
 
-    @contextmanager
-    def _session_scope(self):
-        _session: Session = self.sess_maker()
+    @asynccontextmanager
+    async def _session_scope(self, operation: str):
+        # Имя метода для лога медленных запросов, включая flush и commit
+        operation = f'{type(self).__name__}.{operation}'
+        unit = current_unit_of_work()
+        if unit is not None:
+            # Обработка апдейта идёт в одной транзакции, её завершает unit
+            with db_operation(operation):
+                async with unit.scope() as _session:
+                    yield _session
+            return
+        _session: AsyncSession = self.sess_maker()
         try:
-            yield _session
-            _session.commit()
+            with db_operation(operation):
+                yield _session
+                await _session.commit()
         except Exception:
-            _session.rollback()
+            await _session.rollback()
             raise
         finally:
-            _session.close()
+            await _session.close()
     
-    def add_chat(self, chat_id: int, name: str) -> None:
+    async def add_chat(self, chat_id: int, name: str) -> None:
         """Add information about chat."""
-        with self._session_scope() as session:
-            existing_chat = session.get(DbChat, chat_id)
+        async with self._session_scope('add_chat') as session:
+            existing_chat = await session.get(DbChat, chat_id)
             if existing_chat:
                 raise AlreadyExistsException(f"Информация о чате {chat_id} \
                                              уже существует")
@@ -37,25 +53,27 @@ class SQLChatManager(BaseChatManager):
                     )
             session.add(new_chat)
     
-    def remove_chat(self, chat_id: int) -> None:
+    async def remove_chat(self, chat_id: int) -> None:
         """Removes all information about chat
           including links between chat and tags etc."""
-        with self._session_scope() as session:
-            existing_chat = session.get(DbChat, chat_id)
+        async with self._session_scope('remove_chat') as session:
+            existing_chat = await session.get(DbChat, chat_id)
             if not existing_chat:
                 raise NotFoundException(f"Информация о чате {chat_id} \
                                         не найдена")
-            session.delete(existing_chat)
+            await session.delete(existing_chat)
+        if self.membership_cache is not None:
+            after_commit(lambda: self.membership_cache.discard_chat(chat_id))
     
-    def remember_user(self, user_id: int, chat_id: int,
-                       is_main: bool = True) -> None:
+    async def remember_user(self, user_id: int, chat_id: int,
+                            is_main: bool = True) -> None:
         """Associate a user with a chat."""
-        with self._session_scope() as session:
-            existing_chat = session.get(DbChat, chat_id)
+        async with self._session_scope('remember_user') as session:
+            existing_chat = await session.get(DbChat, chat_id)
             if not existing_chat:
                 raise NotFoundException(f"Информация о чате \
                                         {chat_id} не найдена")
-            existing_userchat = session.get(DbUserChat, (user_id, chat_id))
+            existing_userchat = await session.get(DbUserChat, (user_id, chat_id))
             if existing_userchat:
                 raise AlreadyExistsException(f"Связь пользователя" \
                 " {user_id} и чата {chat_id} уже существует")
@@ -66,75 +84,90 @@ class SQLChatManager(BaseChatManager):
                     is_main=is_main
                 )
                 session.add(new_association)
+        if self.membership_cache is not None:
+            after_commit(lambda: self.membership_cache.add(user_id, chat_id))
     
-    def forget_user(self, user_id: int, chat_id: int) -> None:
+    async def forget_user(self, user_id: int, chat_id: int) -> None:
         """Disassociate a user from a chat."""
-        with self._session_scope() as session:
-            association = session.get(DbUserChat, (user_id, chat_id))
+        async with self._session_scope('forget_user') as session:
+            association = await session.get(DbUserChat, (user_id, chat_id))
             
             if association is not None:
-                session.delete(association)
+                await session.delete(association)
             else:
                 raise NotFoundException(f"Связь пользователя" \
                 " {user_id} и чата {chat_id} не найдена в хранилище")
+        if self.membership_cache is not None:
+            after_commit(lambda: self.membership_cache.discard(user_id, chat_id))
     
-    def get_user_chats(self, user_id: int) -> List[Chat]:
+    async def get_user_chats(self, user_id: int) -> List[Chat]:
         """Get all chats associated with a user."""
-        with self._session_scope() as session:
-            user_chats = session.query(DbUserChat).filter_by(
-                user_id=user_id
-            ).all()
+        async with self._session_scope('get_user_chats') as session:
+            # В асинхронной сессии ленивая загрузка c.chat недоступна,
+            # поэтому чаты подтягиваются одним запросом через join
+            user_chats = (await session.scalars(
+                select(DbChat)
+                .join(DbUserChat, DbUserChat.chat_id == DbChat.id)
+                .where(DbUserChat.user_id == user_id)
+            )).all()
             if not user_chats:
                 raise NotFoundException(f"Не найдены записи о чатах \
                                         пользователя {user_id}")
-            # должно вроде работать через навигационные свойства
-            return [Chat(name=c.chat.name, id=c.chat.id) for c in user_chats]
+            return [Chat(name=c.name, id=c.id) for c in user_chats]
     
-    def get_chat_users(self, chat_id: int) -> List[int]:
+    async def get_chat_users(self, chat_id: int) -> List[int]:
         """Get all users associated with a chat."""
-        with self._session_scope() as session:
-            existing_chat = session.get(DbChat, chat_id)
+        async with self._session_scope('get_chat_users') as session:
+            existing_chat = await session.get(DbChat, chat_id)
             if not existing_chat:
                 raise NotFoundException(f"Информация о чате \
                                         {chat_id} не найдена")
-            associations = session.query(DbUserChat).filter_by(
-                chat_id=chat_id
-            ).all()
-            if not associations:
+            user_ids = (await session.scalars(
+                select(DbUserChat.user_id)
+                .where(DbUserChat.chat_id == chat_id)
+            )).all()
+            if not user_ids:
                 raise NotFoundException(f"Не найдены записи " \
                 "о пользователях чата {chat_id}")
-            return [assoc.user_id for assoc in associations]
+            return list(user_ids)
     
-    def get_chat(self, chat_id: int) -> Chat:
-        with self._session_scope() as session:
-            chat = session.get(DbChat, chat_id)
+    async def get_chat(self, chat_id: int) -> Chat:
+        async with self._session_scope('get_chat') as session:
+            chat = await session.get(DbChat, chat_id)
             if not chat:
                 raise NotFoundException(f"Информация о чате {chat_id} не найдена")
-            return chat
+            return Chat(name=chat.name, id=chat.id)
 
-    def get_main_chat(self, user_id: int) -> Optional[Chat]:
+    async def get_main_chat(self, user_id: int) -> Optional[Chat]:
         """Get the main chat associated with a user."""
-        with self._session_scope() as session:
-            association = session.query(DbUserChat).filter_by(
-                user_id=user_id,
-                is_main=True
-            ).first()
+        async with self._session_scope('get_main_chat') as session:
+            association = (await session.scalars(
+                select(DbUserChat)
+                .filter_by(user_id=user_id, is_main=True)
+            )).first()
             return association.chat_id if association else None
     
-    def get_ext_chats(self, user_id: int) -> List[Chat]:
+    async def get_ext_chats(self, user_id: int) -> List[Chat]:
         """Get the non-main chats associated with a user."""
-        with self._session_scope() as session:
-            user_chats = session.query(DbUserChat).filter_by(
-                user_id=user_id,
-                is_main=False
-            ).all()
+        async with self._session_scope('get_ext_chats') as session:
+            user_chats = (await session.scalars(
+                select(DbChat)
+                .join(DbUserChat, DbUserChat.chat_id == DbChat.id)
+                .where(DbUserChat.user_id == user_id,
+                       DbUserChat.is_main.is_(False))
+            )).all()
             if not user_chats:
                 raise NotFoundException(f"Не найдены записи о чатах \
                                         пользователя {user_id}")
-            return [Chat(name=c.chat.name, id=c.chat.id) for c in user_chats]
+            return [Chat(name=c.name, id=c.id) for c in user_chats]
         
-    def is_user_in_chat(self, user_id: int, chat_id: int) -> bool:
+    async def is_user_in_chat(self, user_id: int, chat_id: int) -> bool:
         """Check if a user is associated with a chat."""
-        with self._session_scope() as session:
-            user_in_chat = session.get(DbUserChat, (user_id, chat_id))
-            return user_in_chat is not None
+        cache = self.membership_cache
+        if cache is not None and cache.contains(user_id, chat_id):
+            return True
+        async with self._session_scope('is_user_in_chat') as session:
+            user_in_chat = await session.get(DbUserChat, (user_id, chat_id))
+        if user_in_chat is not None and cache is not None:
+            after_commit(lambda: cache.add(user_id, chat_id))
+        return user_in_chat is not None
@@ -1,10 +1,144 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sql_adapters.models import Base
+import os
+from typing import Dict, Optional
 
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import Connection, Select, select, func, inspect, literal_column, table, column, make_url, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.pool import NullPool
+from sql_adapters.models import DbMessageText, MESSAGE_TEXT_TSVECTOR
+from sql_adapters.instrumentation import InstrumentedQueuePool, instrument_engine
 
-def init_db(url: str):
-    engine = create_engine(url)
-    sess_maker = sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
-    Base.metadata.create_all(bind=engine)
-    return sess_maker
\ No newline at end of file
+
+MIGRATIONS_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                 'alembic.ini')
+# Schema that create_all produced before migrations were introduced
+BASELINE_REVISION = '0001'
+
+
+async def init_db(url: str,
+                  pool_size: int = 5,
+                  max_overflow: int = 10,
+                  pool_timeout: float = 30.0,
+                  pool_recycle: float = -1,
+                  pool_pre_ping: bool = False,
+                  statement_timeout: Optional[float] = None,
+                  idle_in_transaction_timeout: Optional[float] = None,
+                  slow_query_threshold: Optional[float] = None) -> async_sessionmaker:
+    """
+    Migrate the database and build the session factory for the managers.
+
+    Pool settings are passed to SQLAlchemy as is, `statement_timeout`
+    and `idle_in_transaction_timeout` (seconds) are set for every
+    PostgreSQL connection. Statements slower
+    than `slow_query_threshold` seconds are logged with the manager
+    method that issued them. See `pool_stats` for pool metrics.
+    """
+    db_url = make_url(url)
+    engine_options = {}
+    # In-memory SQLite lives in a single connection and can't be pooled
+    pooled = db_url.database not in (None, '', ':memory:')
+    if pooled:
+        engine_options.update(poolclass=InstrumentedQueuePool,
+                              pool_size=pool_size,
+                              max_overflow=max_overflow,
+                              pool_timeout=pool_timeout,
+                              pool_recycle=pool_recycle,
+                              pool_pre_ping=pool_pre_ping)
+    server_settings = {}
+    if statement_timeout:
+        server_settings['statement_timeout'] = str(int(statement_timeout * 1000))
+    if idle_in_transaction_timeout:
+        # Сервер закрывает сессии, забытые посреди транзакции
+        server_settings['idle_in_transaction_session_timeout'] = \
+            str(int(idle_in_transaction_timeout * 1000))
+    if server_settings and db_url.get_driver_name() == 'asyncpg':
+        engine_options['connect_args'] = {'server_settings': server_settings}
+    engine = create_async_engine(url, **engine_options)
+    if db_url.get_backend_name() == 'sqlite':
+        enable_sqlite_savepoints(engine)
+    instrument_engine(engine, slow_query_threshold)
+    sess_maker = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False)
+
+    # Migrations run on a connection of their own: they are not limited
+    # by statement_timeout and don't show up in the pool metrics.
+    # Some of them commit in batches or run statements outside
+    # of a transaction, so they manage transactions themselves.
+    migration_engine = create_async_engine(url, poolclass=NullPool) if pooled else engine
+    try:
+        async with migration_engine.connect() as conn:
+            await conn.run_sync(upgrade_schema)
+    finally:
+        if migration_engine is not engine:
+            await migration_engine.dispose()
+    return sess_maker
+
+
+def enable_sqlite_savepoints(engine: AsyncEngine) -> None:
+    """
+    Let SQLAlchemy rather than the sqlite3 driver begin transactions.
+    The driver's own transaction handling breaks SAVEPOINT, which
+    `UnitOfWork` uses to roll back a failed manager call.
+    """
+    @event.listens_for(engine.sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine.sync_engine, 'begin')
+    def on_begin(conn):
+        conn.exec_driver_sql('BEGIN')
+
+
+def pool_stats(sess_maker: async_sessionmaker) -> Dict[str, float]:
+    """Return connection pool metrics of a factory built by `init_db`."""
+    pool = sess_maker.kw['bind'].sync_engine.pool
+    metrics = getattr(pool, 'metrics', None)
+    return metrics.stats() if metrics is not None else {}
+
+
+def upgrade_schema(connection: Connection) -> None:
+    """Apply pending migrations. A database created by `create_all`
+    before migrations existed is first marked as the baseline revision."""
+    config = Config(MIGRATIONS_CONFIG)
+    config.attributes['connection'] = connection
+    tables = inspect(connection).get_table_names()
+    connection.commit()
+    if 'chat' in tables and 'alembic_version' not in tables:
+        command.stamp(config, BASELINE_REVISION)
+    command.upgrade(config, 'head')
+
+
+def insert_ignore(session: AsyncSession, model):
+    """Build `INSERT ... ON CONFLICT DO NOTHING` for the session's dialect."""
+    if session.bind.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert
+    return insert(model).on_conflict_do_nothing()
+
+
+def search_message_text(session: AsyncSession, query: str) -> Select:
+    """
+    Build a select of `(chat_id, message_id)` whose texts match `query`,
+    best matches first. Uses PostgreSQL full-text search with Russian and
+    English stemming, or FTS5 with plain terms on SQLite.
+    """
+    if session.bind.dialect.name == 'sqlite':
+        fts = table('message_text_fts', column('rowid'), column('rank'))
+        # Каждое слово в кавычках, чтобы пунктуация не разбиралась
+        # как синтаксис запросов FTS5; слова объединяются через AND
+        fts_query = ' '.join('"' + term.replace('"', '""') + '"' for term in query.split())
+        return (select(DbMessageText.chat_id, DbMessageText.message_id)
+                .join(fts, fts.c.rowid == literal_column('message_text.rowid'))
+                .where(literal_column('message_text_fts').op('MATCH')(fts_query))
+                .group_by(DbMessageText.chat_id, DbMessageText.message_id)
+                # rank в FTS5 тем меньше, чем лучше совпадение
+                .order_by(func.min(fts.c.rank)))
+
+    vector = literal_column(MESSAGE_TEXT_TSVECTOR)
+    ts_query = (func.websearch_to_tsquery(literal_column("'russian'::regconfig"), query)
+                .op('||')(func.websearch_to_tsquery(literal_column("'english'::regconfig"), query)))
+    return (select(DbMessageText.chat_id, DbMessageText.message_id)
+            .where(vector.op('@@')(ts_query))
+            .group_by(DbMessageText.chat_id, DbMessageText.message_id)
+            .order_by(func.max(func.ts_rank(vector, ts_query)).desc()))
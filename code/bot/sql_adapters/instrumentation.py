@@ -0,0 +1,136 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+logger = logging.getLogger(__name__)
+
+# Метод менеджера, выполняющий текущие запросы; виден и внутри
+# greenlet'ов, в которых SQLAlchemy вызывает события движка
+_operation: ContextVar[Optional[str]] = ContextVar('db_operation', default=None)
+
+
+@contextmanager
+def db_operation(name: str) -> Iterator[None]:
+    """Attribute queries issued inside the block to `name`."""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+class PoolMetrics:
+    """
+    Checkout counters and wait times of an engine's connection pool.
+    Waits are only measured with `InstrumentedQueuePool`, the other
+    counters come from pool events and work with any pool.
+    """
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.waits += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, float]:
+        """Return pool occupancy and checkout wait metrics."""
+        pool = self.engine.pool
+        stats: Dict[str, float] = {
+            'checkouts': self.checkouts,
+            'connects': self.connects,
+            'invalidations': self.invalidations,
+            'timeouts': self.timeouts,
+            'avg_wait': self.total_wait / self.waits if self.waits else 0.0,
+            'max_wait': self.max_wait,
+        }
+        if isinstance(pool, AsyncAdaptedQueuePool):
+            stats.update(size=pool.size(), checked_out=pool.checkedout(),
+                         overflow=pool.overflow())
+        return stats
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that measures how long checkouts wait for a connection."""
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics is not None:
+                self.metrics.timeouts += 1
+            raise
+        finally:
+            if self.metrics is not None:
+                self.metrics.record_wait(time.perf_counter() - started)
+
+    def recreate(self):
+        # engine.dispose() и инвалидация пересоздают пул, счётчики сохраняются
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def instrument_engine(engine: AsyncEngine,
+                      slow_query_threshold: Optional[float] = None) -> PoolMetrics:
+    """
+    Count pool checkouts and log statements slower than
+    `slow_query_threshold` seconds together with the manager method
+    that issued them.
+    """
+    metrics = PoolMetrics(engine)
+    sync_engine = engine.sync_engine
+    if isinstance(sync_engine.pool, InstrumentedQueuePool):
+        sync_engine.pool.metrics = metrics
+
+    @event.listens_for(sync_engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        metrics.connects += 1
+
+    @event.listens_for(sync_engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.checkouts += 1
+
+    @event.listens_for(sync_engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.invalidations += 1
+
+    if slow_query_threshold is None:
+        return metrics
+
+    @event.listens_for(sync_engine, 'before_cursor_execute')
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, 'after_cursor_execute')
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_started_at'].pop()
+        if elapsed >= slow_query_threshold:
+            logger.warning("Slow query (%.3f s) in %s: %s",
+                           elapsed, _operation.get() or 'unknown', statement)
+
+    @event.listens_for(sync_engine, 'handle_error')
+    def on_error(context):
+        # after_cursor_execute не вызывается для упавших запросов
+        if context.connection is not None:
+            started = context.connection.info.get('query_started_at')
+            if started:
+                started.pop()
+
+    return metrics
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+
+class MembershipCache:
+    """
+    In-process TTL + LRU cache of confirmed (user_id, chat_id) memberships.
+
+    Only positive results are cached: a missing entry always falls back to
+    the database, so a user who has just joined a chat is never rejected.
+    `SQLChatManager` invalidates entries when memberships change, the TTL
+    bounds staleness for changes made by other processes.
+    """
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Tuple[int, int], float] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def contains(self, user_id: int, chat_id: int) -> bool:
+        """Check for a live entry, counting the lookup as a hit or a miss."""
+        key = (user_id, chat_id)
+        expires_at = self._entries.get(key)
+        if expires_at is None or expires_at < time.monotonic():
+            if expires_at is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True
+
+    def add(self, user_id: int, chat_id: int) -> None:
+        """Remember a confirmed membership, evicting the least recently used entry."""
+        key = (user_id, chat_id)
+        self._entries[key] = time.monotonic() + self.ttl
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, user_id: int, chat_id: int) -> None:
+        """Forget a single membership."""
+        self._entries.pop((user_id, chat_id), None)
+
+    def discard_chat(self, chat_id: int) -> None:
+        """Forget all memberships of a chat."""
+        for key in [k for k in self._entries if k[1] == chat_id]:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters and the current number of entries."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
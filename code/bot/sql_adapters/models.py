@@ -1,6 +1,7 @@
 from __future__ import annotations
-from sqlalchemy import Column, BigInteger, String, Boolean, ForeignKey, ForeignKeyConstraint
+from sqlalchemy import Column, BigInteger, Integer, String, Text, Boolean, DateTime, ForeignKey, Index, UniqueConstraint, false
 from sqlalchemy.orm import relationship, Mapped, mapped_column, declarative_base
+from datetime import datetime
 from typing import List
 
 Base = declarative_base()
@@ -39,15 +40,33 @@ class DbUserChat(Base):
     chat_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('chat.id', ondelete='CASCADE'), primary_key=True)
     is_main: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
 
+    __table_args__ = (
+        Index('ix_user_chat_user_main', 'user_id', 'is_main'),
+        Index('ix_user_chat_chat', 'chat_id', 'user_id'),
+    )
+
     chat: Mapped[DbChat] = relationship("DbChat", back_populates="relationships")
 
 
+# Integer в SQLite, чтобы столбец стал псевдонимом rowid и получал значения сам
+TagId = BigInteger().with_variant(Integer, 'sqlite')
+
+
 class DbTag(Base):
     __tablename__ = 'tag'
-    
-    name: Mapped[str] = mapped_column(String, primary_key=True, nullable=False)
+
+    id: Mapped[int] = mapped_column(TagId, primary_key=True, autoincrement=True)
+    name: Mapped[str] = mapped_column(String, nullable=False)
     chat_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('chat.id', ondelete='CASCADE'),
-                                         primary_key=True, nullable=False)
+                                         nullable=False)
+    # Число сообщений с тегом и время последнего присвоения,
+    # поддерживаются SQLTagManager при каждом изменении связей
+    usage_count: Mapped[int] = mapped_column(Integer, default=0, server_default='0', nullable=False)
+    last_used_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('chat_id', 'name', name='uq_tag_chat_name'),
+    )
 
     message_tags: Mapped[List[DbMessageTag]] = relationship(
         "DbMessageTag",
@@ -59,25 +78,23 @@ class DbTag(Base):
 
 
 class DbMessageTag(Base):
+    """
+    Связь сообщения с тегом. Ссылается на тег по числовому id,
+    поэтому имя тега не повторяется в каждой строке, а переименование
+    не затрагивает связи. Первичный ключ обслуживает поиск сообщений
+    по тегу, индекс по message_id — поиск тегов сообщения.
+    """
     __tablename__ = 'message_tag'
-    
+
+    tag_id: Mapped[int] = mapped_column(TagId, ForeignKey('tag.id', ondelete='CASCADE'),
+                                        primary_key=True)
     message_id: Mapped[str] = mapped_column(String, primary_key=True)
-    tag_name: Mapped[str] = mapped_column(String, primary_key=True)
-    tag_chat_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
 
     __table_args__ = (
-        ForeignKeyConstraint(
-            ['tag_name', 'tag_chat_id'],
-            ['tag.name', 'tag.chat_id'],
-            ondelete='CASCADE'
-        ),
+        Index('ix_message_tag_message', 'message_id', 'tag_id'),
     )
 
-    tag: Mapped[DbTag] = relationship(
-        "DbTag", 
-        back_populates="message_tags",
-        foreign_keys=[tag_name, tag_chat_id]
-    )
+    tag: Mapped[DbTag] = relationship("DbTag", back_populates="message_tags")
 
 
 class DbSessionMessage(Base):
@@ -85,12 +102,47 @@ class DbSessionMessage(Base):
     Таблица хранит сообщения, которые были отправлены
     ботом в указанный чат в рамках текущего запроса пользователя, 
     именно они будут удалены при следующей команде 
-    пользователя, чтобы не засорять чат
+    пользователя, чтобы не засорять чат.
+    После завершения сессии сообщения помечаются pending_deletion
+    и хранятся, пока фоновый обработчик не удалит их из чата.
+    deletion_lease_until - до какого момента удалением занята
+    реплика, которая их захватила
     """
     __tablename__ = 'chat_session_messages'
     
     message_id: Mapped[str] = mapped_column(String, primary_key=True)
     chat_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('chat.id', ondelete='CASCADE'),
                                          primary_key=True, nullable=False)
+    pending_deletion: Mapped[bool] = mapped_column(Boolean, default=False,
+                                                   server_default=false(), nullable=False)
+    deletion_lease_until: Mapped[datetime | None] = mapped_column(DateTime(timezone=True),
+                                                                  nullable=True)
+
+    __table_args__ = (
+        Index('ix_chat_session_messages_chat', 'chat_id', 'pending_deletion'),
+    )
 
     chat: Mapped[DbChat] = relationship("DbChat", back_populates="session_messages")
+
+
+class DbMessageText(Base):
+    """
+    Текст сообщений для полнотекстового поиска. `source` отличает
+    тексты одного сообщения: 'text' — текст самого сообщения,
+    сохраняется при добавлении тега, 'ocr' — распознанный с изображения.
+    В PostgreSQL текст индексируется GIN-индексом по tsvector
+    (русская и английская конфигурации), в SQLite — таблицей FTS5.
+    Индексы создаются миграцией 0003.
+    """
+    __tablename__ = 'message_text'
+
+    chat_id: Mapped[int] = mapped_column(BigInteger, ForeignKey('chat.id', ondelete='CASCADE'),
+                                         primary_key=True)
+    message_id: Mapped[str] = mapped_column(String, primary_key=True)
+    source: Mapped[str] = mapped_column(String(16), primary_key=True)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+
+
+# Выражение должно совпадать с GIN-индексом из миграции 0003,
+# иначе PostgreSQL не сможет использовать индекс в запросах поиска
+MESSAGE_TEXT_TSVECTOR = "(to_tsvector('russian', text) || to_tsvector('english', text))"
@@ -1,54 +1,112 @@
-from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy import delete, or_, update, tuple_
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from exceptions import AlreadyExistsException, NotFoundException
-from contextlib import contextmanager
-from typing import List
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
 
 from interfaces.sessions import BaseSessionsManager
 from sql_adapters.models import DbUserChat, DbChat, DbSessionMessage
+from sql_adapters.membership_cache import MembershipCache
+from sql_adapters.instrumentation import db_operation
+from sql_adapters.unit_of_work import after_commit, current_unit_of_work
 
 
 class SQLSessionManager(BaseSessionsManager):
-    def __init__(self, sess_maker: sessionmaker):
+    def __init__(self, sess_maker: async_sessionmaker,
+                 membership_cache: Optional[MembershipCache] = None,
+                 deletion_lease: float = 600.0):
         self.sess_maker = sess_maker
+        self.membership_cache = membership_cache
+        # Сколько секунд сообщения, взятые на удаление, не достанутся
+        # другим репликам; после падения реплики их подберут остальные
+        self.deletion_lease = timedelta(seconds=deletion_lease)
 
-    @contextmanager
-    def _session_scope(self):
-        _session: Session = self.sess_maker()
+    @asynccontextmanager
+    async def _session_scope(self, operation: str):
+        # Имя метода для лога медленных запросов, включая flush и commit
+        operation = f'{type(self).__name__}.{operation}'
+        unit = current_unit_of_work()
+        if unit is not None:
+            # Обработка апдейта идёт в одной транзакции, её завершает unit
+            with db_operation(operation):
+                async with unit.scope() as _session:
+                    yield _session
+            return
+        _session: AsyncSession = self.sess_maker()
         try:
-            yield _session
-            _session.commit()
+            with db_operation(operation):
+                yield _session
+                await _session.commit()
         except Exception:
-            _session.rollback()
+            await _session.rollback()
             raise
         finally:
-            _session.close()
+            await _session.close()
     
-    def _ensure_user_in_chat(self, user_id: int, chat_id: int,
-                              dbsession: Session) -> None:
-        if dbsession.get(DbUserChat, (user_id, chat_id)) is None:
+    async def _ensure_user_in_chat(self, user_id: int, chat_id: int,
+                                   dbsession: AsyncSession) -> None:
+        cache = self.membership_cache
+        if cache is not None and cache.contains(user_id, chat_id):
+            return
+        if await dbsession.get(DbUserChat, (user_id, chat_id)) is None:
             raise NotFoundException(f"Пользователь {user_id} \
                                     не найден в чате {chat_id}")
+        if cache is not None:
+            # Членство могло появиться в ещё не закоммиченной транзакции
+            after_commit(lambda: cache.add(user_id, chat_id))
     
-    def update_session(self, user_id: int, 
-                      chat_id: int, messages: List[str]) -> None:
+    async def update_session(self, user_id: int, 
+                             chat_id: int, messages: List[str]) -> None:
         """Adds messages to a session"""
-        with self._session_scope() as dbsession:
-            existing_chat = dbsession.get(DbChat, chat_id)
+        async with self._session_scope('update_session') as dbsession:
+            existing_chat = await dbsession.get(DbChat, chat_id)
             if not existing_chat:
                 raise NotFoundException(f"Информация о чате {chat_id} \
                                              не найдена")
-            self._ensure_user_in_chat(user_id, chat_id, dbsession)
+            await self._ensure_user_in_chat(user_id, chat_id, dbsession)
             for m in messages:
                 dbsession.add(DbSessionMessage(message_id=m, chat_id=chat_id))
 
-    def end_session(self, chat_id: int) -> List[str]:
-        """Ends session, deletes and returns messages from this session"""
-        with self._session_scope() as dbsession:
-            message_ids = (dbsession.query(DbSessionMessage.message_id)
-                    .filter(DbSessionMessage.chat_id == chat_id)
-                    .all())
-            ans = [mid[0] for mid in message_ids]
-            (dbsession.query(DbSessionMessage)
-                .filter(DbSessionMessage.chat_id == chat_id)
-                .delete())
-            return ans
\ No newline at end of file
+    async def end_session(self, chat_id: int) -> List[str]:
+        """Ends session, marks messages from this session
+        as pending deletion and returns them"""
+        async with self._session_scope('end_session') as dbsession:
+            # Записи остаются в таблице до фактического удаления из чата,
+            # чтобы после перезапуска бота их можно было дочистить.
+            # Удаляет их реплика, завершившая сессию, поэтому она сразу
+            # берёт их в аренду
+            marked = await dbsession.execute(
+                update(DbSessionMessage)
+                .where(DbSessionMessage.chat_id == chat_id,
+                       DbSessionMessage.pending_deletion.is_(False))
+                .values(pending_deletion=True,
+                        deletion_lease_until=datetime.now(timezone.utc) + self.deletion_lease)
+                .returning(DbSessionMessage.message_id))
+            return [mid for (mid,) in marked.all()]
+
+    async def claim_pending_deletions(self) -> List[Tuple[int, str]]:
+        """Claims messages pending deletion that no other replica
+        is deleting and returns them as (chat_id, message_id)"""
+        now = datetime.now(timezone.utc)
+        async with self._session_scope('claim_pending_deletions') as dbsession:
+            # Захват одним UPDATE: строку получает только одна реплика
+            claimed = await dbsession.execute(
+                update(DbSessionMessage)
+                .where(DbSessionMessage.pending_deletion.is_(True),
+                       or_(DbSessionMessage.deletion_lease_until.is_(None),
+                           DbSessionMessage.deletion_lease_until < now))
+                .values(deletion_lease_until=now + self.deletion_lease)
+                .returning(DbSessionMessage.chat_id, DbSessionMessage.message_id))
+            return [(chat_id, mid) for chat_id, mid in claimed.all()]
+
+    async def remove_session_messages(self, messages: List[Tuple[int, str]]) -> None:
+        """Forgets messages given as (chat_id, message_id)
+        once they are deleted from the chat"""
+        if not messages:
+            return
+        async with self._session_scope('remove_session_messages') as dbsession:
+            await dbsession.execute(
+                delete(DbSessionMessage)
+                .where(tuple_(DbSessionMessage.chat_id,
+                              DbSessionMessage.message_id).in_(messages)))
@@ -1,346 +1,646 @@
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy import func
+from collections import Counter
+from sqlalchemy import select, update, delete, func, case, and_, or_, not_, false, Select, ColumnElement
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from sqlalchemy.orm import aliased
 from exceptions import AlreadyExistsException, NotFoundException
-from contextlib import contextmanager
-from typing import List, Dict, Iterator
+from contextlib import asynccontextmanager
+from typing import List, Dict, AsyncIterator, Optional, Set, Tuple
 
-from models import Tag, Message, TagOperation
+from models import Tag, Message, MessagePage, TagOperation, TagOrder, TagQuery, TagTerm, TagNot, TagGroup
 from interfaces.tags import BaseTagManager
-from sql_adapters.models import DbTag, DbMessageTag, DbUserChat
+from sql_adapters.models import DbTag, DbMessageTag, DbUserChat, DbMessageText
+from sql_adapters.membership_cache import MembershipCache
+from sql_adapters.instrumentation import db_operation
+from sql_adapters.unit_of_work import after_commit, current_unit_of_work
+from sql_adapters.db import insert_ignore, search_message_text
+
+def _query_tag_names(query: TagQuery) -> List[str]:
+    """All tag names the query refers to, without repeats."""
+    if isinstance(query, TagTerm):
+        return [query.tag.name]
+    if isinstance(query, TagNot):
+        return _query_tag_names(query.operand)
+    return list(dict.fromkeys(name for operand in query.operands
+                              for name in _query_tag_names(operand)))
+
+
+def _required_tag_names(query: TagQuery) -> Set[str]:
+    """Tag names every message matching the query must have."""
+    if isinstance(query, TagTerm):
+        return {query.tag.name}
+    if isinstance(query, TagNot):
+        return set()
+    required = [_required_tag_names(operand) for operand in query.operands]
+    if query.op == TagOperation.AND:
+        return set().union(*required)
+    return set.intersection(*required)
+
+
+def _matches_without_tags(query: TagQuery) -> bool:
+    """Whether a message having none of the query's tags matches it."""
+    if isinstance(query, TagTerm):
+        return False
+    if isinstance(query, TagNot):
+        return not _matches_without_tags(query.operand)
+    matches = [_matches_without_tags(operand) for operand in query.operands]
+    return all(matches) if query.op == TagOperation.AND else any(matches)
+
+
+def _compile_tag_query(query: TagQuery, tag_ids: Dict[str, int]) -> ColumnElement:
+    """
+    Compile the query into a HAVING condition over `message_tag` rows
+    grouped by message: each tag becomes a "message has the tag" flag
+    aggregated in the same pass, so the whole expression is checked
+    in one scan instead of a separate query per tag.
+    `tag_ids` maps names of existing tags to their ids.
+    """
+    if isinstance(query, TagTerm):
+        if query.tag.name not in tag_ids:
+            return false()
+        return func.max(case((DbMessageTag.tag_id == tag_ids[query.tag.name], 1), else_=0)) == 1
+    if isinstance(query, TagNot):
+        return not_(_compile_tag_query(query.operand, tag_ids))
+    operands = [_compile_tag_query(operand, tag_ids) for operand in query.operands]
+    return and_(*operands) if query.op == TagOperation.AND else or_(*operands)
+
 
 class SQLTagManager(BaseTagManager):
-    def __init__(self, sess_maker: sessionmaker):
+    def __init__(self, sess_maker: async_sessionmaker,
+                 membership_cache: Optional[MembershipCache] = None):
         self.sess_maker = sess_maker
-    
-    @contextmanager
-    def _session_scope(self) -> Iterator[Session]:
-        session: Session = self.sess_maker()
+        self.membership_cache = membership_cache
+
+    @asynccontextmanager
+    async def _session_scope(self, operation: str) -> AsyncIterator[AsyncSession]:
+        # Имя метода для лога медленных запросов, включая flush и commit
+        operation = f'{type(self).__name__}.{operation}'
+        unit = current_unit_of_work()
+        if unit is not None:
+            # Обработка апдейта идёт в одной транзакции, её завершает unit
+            with db_operation(operation):
+                async with unit.scope() as session:
+                    yield session
+            return
+        session: AsyncSession = self.sess_maker()
         try:
-            yield session
-            session.commit()
+            with db_operation(operation):
+                yield session
+                await session.commit()
         except Exception:
-            session.rollback()
+            await session.rollback()
             raise
         finally:
-            session.close()
+            await session.close()
 
-    def _ensure_user_in_chat(self, user_id: int, chat_id: int,
-                              session: Session) -> None:
-        if session.get(DbUserChat, (user_id, chat_id)) is None:
+    async def _ensure_user_in_chat(self, user_id: int, chat_id: int,
+                                   session: AsyncSession) -> None:
+        cache = self.membership_cache
+        if cache is not None and cache.contains(user_id, chat_id):
+            return
+        if await session.get(DbUserChat, (user_id, chat_id)) is None:
             raise NotFoundException(f"Пользователь {user_id} \
                                     не найден в чате {chat_id}")
+        if cache is not None:
+            # Членство могло появиться в ещё не закоммиченной транзакции
+            after_commit(lambda: cache.add(user_id, chat_id))
+
+    async def _get_tag(self, session: AsyncSession,
+                       chat_id: int, tag: Tag) -> Optional[DbTag]:
+        return await session.scalar(
+            select(DbTag).filter_by(chat_id=chat_id, name=tag.name))
 
-    def _get_or_create_tag(self, session: Session,
-                            chat_id: int, tag: Tag) -> DbTag:
-        db_tag = session.query(DbTag).filter_by(
-            name=tag.name,
-            chat_id=chat_id
-        ).first()
+    async def _get_or_create_tag(self, session: AsyncSession,
+                                 chat_id: int, tag: Tag) -> DbTag:
+        db_tag = await self._get_tag(session, chat_id, tag)
         if db_tag is None:
             db_tag = DbTag(name=tag.name, chat_id=chat_id)
             session.add(db_tag)
-            session.flush()
+            await session.flush()
         return db_tag
 
-    def _check_tag_not_assigned(self, session: Session, chat_id: int, tag: Tag, message_id: str) -> None:
-        existing_message_tag = session.query(DbMessageTag).filter_by(
-            message_id=message_id,
-            tag_name=tag.name,
-            tag_chat_id=chat_id
-        ).first()
+    async def _check_tag_not_assigned(self, session: AsyncSession, chat_id: int,
+                                      db_tag: DbTag, message_id: str) -> None:
+        existing_message_tag = await session.get(
+            DbMessageTag, (db_tag.id, message_id))
         if existing_message_tag:
             raise AlreadyExistsException(
-                f"Тег {tag.name} в чате {chat_id} уже \
+                f"Тег {db_tag.name} в чате {chat_id} уже \
                   присвоен сообщению {message_id}"
             )
 
-    def get_messages(self, user_id: int,
-                      chat_id: int, tag: Tag) -> List[Message]:
+    async def _use_tags(self, session: AsyncSession,
+                        counts: Dict[int, int]) -> None:
+        """Add new assignments to usage counters of tags
+        with the given ids and mark the tags as just used."""
+        if not counts:
+            return
+        # Счётчики меняются в SQL, а не в объектах, чтобы
+        # параллельные транзакции не затирали изменения друг друга
+        await session.execute(
+            update(DbTag)
+            .where(DbTag.id.in_(counts))
+            .values(usage_count=DbTag.usage_count + case(counts, value=DbTag.id, else_=0),
+                    last_used_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+
+    async def _release_tags(self, session: AsyncSession,
+                            counts: Dict[int, int]) -> None:
+        """Subtract removed assignments from usage counters of tags
+        with the given ids and delete tags that are no longer used."""
+        if not counts:
+            return
+        await session.execute(
+            update(DbTag)
+            .where(DbTag.id.in_(counts))
+            .values(usage_count=DbTag.usage_count - case(counts, value=DbTag.id, else_=0))
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(
+            delete(DbTag)
+            .where(DbTag.id.in_(counts), DbTag.usage_count <= 0)
+            .execution_options(synchronize_session=False)
+        )
+
+    async def get_messages(self, user_id: int,
+                           chat_id: int, tag: Tag) -> List[Message]:
         """Return a list of messages that have the given tag."""
-        with self._session_scope() as session:  
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            tagged_messages = session.query(DbMessageTag).filter_by(
-                tag_name=tag.name,
-                tag_chat_id=chat_id
-            ).all()
+        async with self._session_scope('get_messages') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            message_ids = (await session.scalars(
+                select(DbMessageTag.message_id)
+                .join(DbTag)
+                .where(DbTag.chat_id == chat_id, DbTag.name == tag.name)
+            )).all()
             return [
                 Message(
-                    message_id=tm.message_id,
+                    message_id=mid,
                     chat_id=chat_id,
                     tags=[tag]
-                ) for tm in tagged_messages
+                ) for mid in message_ids
             ]
-        
-    def get_messages_multitag(self, user_id: int, chat_id: int, tags: List[Tag], 
-                             tag_op: TagOperation) -> List[Message]:
+
+    async def get_messages_multitag(self, user_id: int, chat_id: int, tags: List[Tag],
+                                    tag_op: TagOperation) -> List[Message]:
         """Return a list of messages by multiple tags."""
         if not tags:
             return []
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
+        async with self._session_scope('get_messages_multitag') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
             tag_names = [tag.name for tag in tags]
             if tag_op == TagOperation.OR:
-                # Для OR: сообщения, у которых есть 
+                # Для OR: сообщения, у которых есть
                 # хотя бы один из указанных тегов
-                tagged_messages = (session.query(DbMessageTag)
-                        .filter(DbMessageTag.tag_chat_id == chat_id,
-                                DbMessageTag.tag_name.in_(tag_names))
-                        .distinct().all())
+                tagged_messages = (await session.execute(
+                    select(DbMessageTag.message_id, DbTag.name)
+                    .join(DbTag)
+                    .where(DbTag.chat_id == chat_id,
+                           DbTag.name.in_(tag_names))
+                    .distinct()
+                )).all()
                 # Получаем теги для каждого сообщения
                 message_tags_map: Dict[str, List[Tag]] = {}
-                for tm in tagged_messages:
-                    if tm.message_id not in message_tags_map:
-                        message_tags_map[tm.message_id] = []
-                    message_tags_map[tm.message_id].append(Tag(name=tm.tag_name))
+                for message_id, tag_name in tagged_messages:
+                    if message_id not in message_tags_map:
+                        message_tags_map[message_id] = []
+                    message_tags_map[message_id].append(Tag(name=tag_name))
                 return [
                     Message(
                         message_id=msg_id,
                         chat_id=chat_id,
                         tags=message_tags
                     ) for msg_id, message_tags in message_tags_map.items()
-                ] 
+                ]
             elif tag_op == TagOperation.AND:
                 # Для AND: сообщения, у которых есть все указанные теги
-                tagged_messages = (session.query(DbMessageTag)
-                        .filter(DbMessageTag.tag_chat_id == chat_id,
-                                DbMessageTag.tag_name.in_(tag_names))
-                        .group_by(DbMessageTag.message_id)
-                        .having(func.count(DbMessageTag.tag_name.distinct()) == len(tags))
-                        .all())
+                message_ids = (await session.scalars(
+                    select(DbMessageTag.message_id)
+                    .join(DbTag)
+                    .where(DbTag.chat_id == chat_id,
+                           DbTag.name.in_(tag_names))
+                    .group_by(DbMessageTag.message_id)
+                    .having(func.count(DbMessageTag.tag_id.distinct()) == len(set(tag_names)))
+                )).all()
                 return [
                     Message(
-                        message_id=tm.message_id,
+                        message_id=mid,
                         chat_id=chat_id,
                         tags=tags
-                    ) for tm in tagged_messages
+                    ) for mid in message_ids
                 ]
 
-    def add_tag(self, user_id: int, chat_id: int,
-                 tag: Tag, message_id: str) -> None:
+    async def get_messages_page(self, user_id: int, chat_id: int,
+                                tags: List[Tag], tag_op: TagOperation,
+                                limit: int, cursor: Optional[str] = None) -> MessagePage:
+        """Return one page of messages by one or multiple tags,
+        ordered by message id and starting after `cursor`."""
+        if not tags:
+            return MessagePage(messages=[], total=0)
+        async with self._session_scope('get_messages_page') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            tag_names = list(dict.fromkeys(tag.name for tag in tags))
+            matching_ids = (select(DbMessageTag.message_id)
+                            .join(DbTag)
+                            .where(DbTag.chat_id == chat_id,
+                                   DbTag.name.in_(tag_names))
+                            .group_by(DbMessageTag.message_id))
+            if tag_op == TagOperation.AND:
+                matching_ids = matching_ids.having(
+                    func.count(DbMessageTag.tag_id.distinct()) == len(tag_names))
+
+            total, page_ids, has_next = await self._fetch_page(session, matching_ids,
+                                                              limit, cursor)
+
+            if tag_op == TagOperation.OR and len(tag_names) > 1:
+                # Для OR у каждого сообщения свой набор совпавших тегов
+                matched = (await session.execute(
+                    select(DbMessageTag.message_id, DbTag.name)
+                    .join(DbTag)
+                    .where(DbTag.chat_id == chat_id,
+                           DbTag.name.in_(tag_names),
+                           DbMessageTag.message_id.in_(page_ids))
+                )).all()
+                message_tags_map: Dict[str, List[Tag]] = {mid: [] for mid in page_ids}
+                for message_id, tag_name in matched:
+                    message_tags_map[message_id].append(Tag(name=tag_name))
+            else:
+                message_tags_map = {mid: list(tags) for mid in page_ids}
+
+            return MessagePage(
+                messages=[
+                    Message(
+                        message_id=mid,
+                        chat_id=chat_id,
+                        tags=message_tags
+                    ) for mid, message_tags in message_tags_map.items()
+                ],
+                total=total,
+                next_cursor=page_ids[-1] if has_next else None
+            )
+
+    async def get_messages_page_by_query(self, user_id: int, chat_id: int,
+                                         query: TagQuery, limit: int,
+                                         cursor: Optional[str] = None) -> MessagePage:
+        """Return one page of messages matching a boolean tag query,
+        ordered by message id and starting after `cursor`."""
+        async with self._session_scope('get_messages_page_by_query') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            # Одним запросом: id тегов для условия и их счётчики для выбора порядка
+            existing_tags = (await session.execute(
+                select(DbTag.name, DbTag.id, DbTag.usage_count)
+                .where(DbTag.chat_id == chat_id, DbTag.name.in_(_query_tag_names(query)))
+            )).all()
+            tag_ids = {name: tag_id for name, tag_id, _ in existing_tags}
+            tag_counts = {name: usage_count for name, _, usage_count in existing_tags}
+            names_by_id = {tag_id: name for name, tag_id in tag_ids.items()}
+
+            matching_ids = (select(DbMessageTag.message_id)
+                            .group_by(DbMessageTag.message_id)
+                            .having(_compile_tag_query(query, tag_ids)))
+            if _matches_without_tags(query):
+                matching_ids = matching_ids.where(DbMessageTag.tag_id.in_(
+                    select(DbTag.id).where(DbTag.chat_id == chat_id)))
+            else:
+                # Подходящее сообщение обязательно имеет один из тегов запроса,
+                # остальные строки можно не читать
+                if not tag_ids:
+                    return MessagePage(messages=[], total=0)
+                matching_ids = matching_ids.where(DbMessageTag.tag_id.in_(list(names_by_id)))
+
+            required = _required_tag_names(query)
+            if required:
+                # Самый редкий из обязательных тегов сужает перебор сильнее всего
+                rarest = min(sorted(required), key=lambda name: tag_counts.get(name, 0))
+                if tag_counts.get(rarest, 0) == 0:
+                    return MessagePage(messages=[], total=0)
+                matching_ids = matching_ids.where(DbMessageTag.message_id.in_(
+                    select(DbMessageTag.message_id)
+                    .where(DbMessageTag.tag_id == tag_ids[rarest])))
+
+            total, page_ids, has_next = await self._fetch_page(session, matching_ids,
+                                                              limit, cursor)
+            matched = (await session.execute(
+                select(DbMessageTag.message_id, DbMessageTag.tag_id)
+                .where(DbMessageTag.tag_id.in_(list(names_by_id)),
+                       DbMessageTag.message_id.in_(page_ids))
+            )).all()
+            message_tags_map: Dict[str, List[Tag]] = {mid: [] for mid in page_ids}
+            for message_id, tag_id in matched:
+                message_tags_map[message_id].append(Tag(name=names_by_id[tag_id]))
+
+            return MessagePage(
+                messages=[
+                    Message(
+                        message_id=mid,
+                        chat_id=chat_id,
+                        tags=message_tags
+                    ) for mid, message_tags in message_tags_map.items()
+                ],
+                total=total,
+                next_cursor=page_ids[-1] if has_next else None
+            )
+
+    async def _fetch_page(self, session: AsyncSession, matching_ids: Select,
+                          limit: int, cursor: Optional[str]) -> Tuple[int, List[str], bool]:
+        """Count message ids selected by `matching_ids` and fetch one page of them.
+        Returns the total count, ids of the page and whether there is a next one."""
+        total = await session.scalar(
+            select(func.count()).select_from(matching_ids.subquery()))
+        # Keyset-пагинация: следующая страница начинается
+        # сразу после последнего id предыдущей
+        page_query = matching_ids
+        if cursor is not None:
+            page_query = page_query.where(DbMessageTag.message_id > cursor)
+        # Лишняя запись показывает, есть ли следующая страница
+        page_ids = list((await session.scalars(
+            page_query.order_by(DbMessageTag.message_id).limit(limit + 1)
+        )).all())
+        return total, page_ids[:limit], len(page_ids) > limit
+
+    async def add_tag(self, user_id: int, chat_id: int,
+                      tag: Tag, message_id: str) -> None:
         """Add a tag to a specific message."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            
-            db_tag = self._get_or_create_tag(session, chat_id, tag)
-            self._check_tag_not_assigned(session, chat_id, tag, message_id)
+        async with self._session_scope('add_tag') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+
+            db_tag = await self._get_or_create_tag(session, chat_id, tag)
+            await self._check_tag_not_assigned(session, chat_id, db_tag, message_id)
             session.add(DbMessageTag(
-                message_id=message_id,
-                tag_name=db_tag.name,
-                tag_chat_id=chat_id
+                tag_id=db_tag.id,
+                message_id=message_id
             ))
-    
-    def add_tags(self, user_id: int, chat_id: int,
-                  tags: List[Tag], message_id: str) -> None:
+            await self._use_tags(session, {db_tag.id: 1})
+
+    async def add_tags(self, user_id: int, chat_id: int,
+                       tags: List[Tag], message_id: str) -> None:
         """Add a list of tags to a specific message."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
+        async with self._session_scope('add_tags') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            used: Counter[int] = Counter()
             for tag in tags:
-                db_tag = self._get_or_create_tag(session, chat_id, tag)
-                self._check_tag_not_assigned(session, chat_id, tag, message_id)
-                session.add(DbMessageTag(
-                    message_id=message_id,
-                    tag_name=db_tag.name,
-                    tag_chat_id=chat_id
-                ))
-    
-    def add_tag_to_many(self, user_id: int, chat_id: int, tag: Tag, 
-                       message_ids: List[str]) -> None:
-        """Add a tag to multiple messages."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            db_tag = self._get_or_create_tag(session, chat_id, tag)
-            for message_id in message_ids:
-                self._check_tag_not_assigned(session, chat_id, tag, message_id)
+                db_tag = await self._get_or_create_tag(session, chat_id, tag)
+                await self._check_tag_not_assigned(session, chat_id, db_tag, message_id)
                 session.add(DbMessageTag(
-                    message_id=message_id,
-                    tag_name=db_tag.name,
-                    tag_chat_id=chat_id
+                    tag_id=db_tag.id,
+                    message_id=message_id
                 ))
+                used[db_tag.id] += 1
+            await self._use_tags(session, used)
 
-    def add_tags_to_many(self, user_id: int, chat_id: int, tags: List[Tag], 
-                        message_ids: List[str]) -> None:
-        """Add multiple tags to multiple messages."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            for message_id in message_ids:
-                for tag in tags:
-                    db_tag = self._get_or_create_tag(session, chat_id, tag)
-                    self._check_tag_not_assigned(session, chat_id, tag, message_id)
-                    session.add(DbMessageTag(
-                        message_id=message_id,
-                        tag_name=db_tag.name,
-                        tag_chat_id=chat_id
-                    ))
-    
-    def rename_tag(self, user_id: int, chat_id: int,
-                    old_tag: Tag, new_tag: Tag) -> None:
-        """Rename an existing tag."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            existing_old_tag = session.query(DbTag).filter_by(
-                name=old_tag.name,
-                chat_id=chat_id
-            ).first()
+    async def _bulk_add_tags(self, session: AsyncSession, chat_id: int,
+                             tags: List[Tag], message_ids: List[str]) -> List[Message]:
+        """Assign every tag to every message with set-based statements
+        and return messages with the tags they already had."""
+        tag_names = list(dict.fromkeys(tag.name for tag in tags))
+        message_ids = list(dict.fromkeys(message_ids))
+        if not tag_names or not message_ids:
+            return []
+        # Недостающие теги создаются одним запросом, вторым читаются id всех
+        await session.execute(
+            insert_ignore(session, DbTag)
+            .values([{'name': name, 'chat_id': chat_id} for name in tag_names])
+        )
+        tag_ids = dict((await session.execute(
+            select(DbTag.name, DbTag.id)
+            .where(DbTag.chat_id == chat_id, DbTag.name.in_(tag_names))
+        )).all())
+        # Все связи вставляются одним многострочным запросом,
+        # RETURNING отдаёт только реально добавленные пары
+        inserted = await session.execute(
+            insert_ignore(session, DbMessageTag)
+            .values([
+                {'tag_id': tag_ids[name], 'message_id': mid}
+                for mid in message_ids for name in tag_names
+            ])
+            .returning(DbMessageTag.message_id, DbMessageTag.tag_id)
+        )
+        inserted_pairs = set(inserted.all())
+        await self._use_tags(session, Counter(tag_id for _, tag_id in inserted_pairs))
+        already_tagged: List[Message] = []
+        for mid in message_ids:
+            existing_tags = [Tag(name=name) for name in tag_names
+                             if (mid, tag_ids[name]) not in inserted_pairs]
+            if existing_tags:
+                already_tagged.append(Message(message_id=mid,
+                                              chat_id=chat_id,
+                                              tags=existing_tags))
+        return already_tagged
+
+    async def add_tag_to_many(self, user_id: int, chat_id: int, tag: Tag,
+                              message_ids: List[str]) -> List[Message]:
+        """Add a tag to multiple messages.
+        Returns messages that already had the tag."""
+        async with self._session_scope('add_tag_to_many') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            return await self._bulk_add_tags(session, chat_id, [tag], message_ids)
+
+    async def add_tags_to_many(self, user_id: int, chat_id: int, tags: List[Tag],
+                               message_ids: List[str]) -> List[Message]:
+        """Add multiple tags to multiple messages.
+        Returns messages with the tags they already had."""
+        async with self._session_scope('add_tags_to_many') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            return await self._bulk_add_tags(session, chat_id, tags, message_ids)
+
+    async def rename_tag(self, user_id: int, chat_id: int,
+                         old_tag: Tag, new_tag: Tag) -> None:
+        """Rename an existing tag, merging it into `new_tag` if that exists."""
+        if old_tag.name == new_tag.name:
+            return
+        async with self._session_scope('rename_tag') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            existing_old_tag = await self._get_tag(session, chat_id, old_tag)
             if not existing_old_tag:
                 raise NotFoundException(f"Старый тег {old_tag.name} \
                                         в чате {chat_id} не найден")
-            existing_new_tag = session.query(DbTag).filter_by(
-                name=new_tag.name,
-                chat_id=chat_id
-            ).first()
-            if existing_new_tag:
-                # Объединяем теги: переносим все сообщения 
-                # со старого тега на новый
-                old_tag_messages = session.query(DbMessageTag).filter_by(
-                    tag_name=existing_old_tag.name,
-                    tag_chat_id=chat_id
-                ).all()
-                for otm in old_tag_messages:
-                    # Проверяем, нет ли уже такого тега у сообщения
-                    existing_assignment = session.query(DbMessageTag).filter_by(
-                        message_id=otm.message_id,
-                        tag_name=existing_new_tag.name,
-                        tag_chat_id=chat_id
-                    ).first()
-                    if not existing_assignment:
-                        otm.tag_name = existing_new_tag.name
-                    else:
-                        # Если тег уже есть, удаляем старую запись
-                        session.delete(otm)
-                # Удаляем старый тег
-                session.delete(existing_old_tag)
-            else:
-                # Просто переименовываем тег
+            existing_new_tag = await self._get_tag(session, chat_id, new_tag)
+            if existing_new_tag is None:
+                # Связи ссылаются на id тега, так что переименование
+                # меняет одну строку
                 existing_old_tag.name = new_tag.name
+                return
 
-    def reassign_tag(self, user_id: int, chat_id: int, message_id: str, 
-                    old_tag: Tag, new_tag: Tag) -> None:
+            # Слияние тегов. Число запросов не зависит
+            # от количества сообщений с тегом.
+            # Сообщения, у которых уже есть новый тег, просто теряют старый
+            new_assignment = aliased(DbMessageTag)
+            await session.execute(
+                delete(DbMessageTag)
+                .where(DbMessageTag.tag_id == existing_old_tag.id,
+                       select(new_assignment.message_id)
+                       .where(new_assignment.tag_id == existing_new_tag.id,
+                              new_assignment.message_id == DbMessageTag.message_id)
+                       .exists())
+                .execution_options(synchronize_session=False)
+            )
+            # Остальные связи переносятся на новый тег одним запросом
+            moved = (await session.execute(
+                update(DbMessageTag)
+                .where(DbMessageTag.tag_id == existing_old_tag.id)
+                .values(tag_id=existing_new_tag.id)
+                .execution_options(synchronize_session=False)
+            )).rowcount
+            last_used_at = existing_old_tag.last_used_at
+            if last_used_at is not None:
+                last_used_at = case((or_(DbTag.last_used_at.is_(None),
+                                         DbTag.last_used_at < last_used_at), last_used_at),
+                                    else_=DbTag.last_used_at)
+            else:
+                last_used_at = DbTag.last_used_at
+            await session.execute(
+                update(DbTag)
+                .where(DbTag.id == existing_new_tag.id)
+                .values(usage_count=DbTag.usage_count + moved, last_used_at=last_used_at)
+                .execution_options(synchronize_session=False)
+            )
+            # Удаляем старый тег
+            await session.delete(existing_old_tag)
+
+    async def reassign_tag(self, user_id: int, chat_id: int, message_id: str,
+                           old_tag: Tag, new_tag: Tag) -> None:
         """Reassign a tag from one to another for a specific message."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
+        async with self._session_scope('reassign_tag') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
             # Добавляем новый тег
-            db_new_tag = self._get_or_create_tag(session, chat_id, new_tag)
-            self._check_tag_not_assigned(session, chat_id, new_tag, message_id)
+            db_new_tag = await self._get_or_create_tag(session, chat_id, new_tag)
+            await self._check_tag_not_assigned(session, chat_id, db_new_tag, message_id)
             session.add(DbMessageTag(
-                message_id=message_id,
-                tag_name=db_new_tag.name,
-                tag_chat_id=chat_id
+                tag_id=db_new_tag.id,
+                message_id=message_id
             ))
+            await self._use_tags(session, {db_new_tag.id: 1})
             # Удаляем старый тег
-            old_message_tag = session.query(DbMessageTag).filter_by(
-                message_id=message_id,
-                tag_name=old_tag.name,
-                tag_chat_id=chat_id
-            ).first()
+            db_old_tag = await self._get_tag(session, chat_id, old_tag)
+            old_message_tag = db_old_tag and await session.get(
+                DbMessageTag, (db_old_tag.id, message_id))
             if old_message_tag:
-                session.delete(old_message_tag)
-                # Проверяем, нужно ли удалять старый тег полностью
-                old_tag_usage = session.query(DbMessageTag).filter_by(
-                    tag_name=old_tag.name,
-                    tag_chat_id=chat_id
-                ).count()
-                if old_tag_usage == 0:
-                    old_db_tag = session.query(DbTag).filter_by(
-                        name=old_tag.name,
-                        chat_id=chat_id
-                    ).first()
-                    if old_db_tag:
-                        session.delete(old_db_tag)
-
-    def get_tags(self, user_id: int, chat_id: int) -> List[Tag]:
-        """Get all tags for a specific chat."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            db_tags = session.query(DbTag).filter_by(chat_id=chat_id).all()
+                await session.delete(old_message_tag)
+                await session.flush()
+                # Старый тег удаляется, если больше ни у кого его нет
+                await self._release_tags(session, {db_old_tag.id: 1})
+
+    async def get_tags(self, user_id: int, chat_id: int,
+                       order: Optional[TagOrder] = None) -> List[Tag]:
+        """Get all tags for a specific chat, optionally
+        most used or most recently used first."""
+        async with self._session_scope('get_tags') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            tags_query = select(DbTag.name).filter_by(chat_id=chat_id)
+            if order == TagOrder.FREQUENCY:
+                tags_query = tags_query.order_by(DbTag.usage_count.desc(), DbTag.name)
+            elif order == TagOrder.RECENCY:
+                tags_query = tags_query.order_by(DbTag.last_used_at.desc().nulls_last(), DbTag.name)
+            tag_names = (await session.scalars(tags_query)).all()
             return [
-                Tag(name=db_tag.name)
-                for db_tag in db_tags
+                Tag(name=name)
+                for name in tag_names
             ]
 
-    def delete_tag(self, user_id: int, chat_id: int, tag: Tag) -> None:
+    async def delete_tag(self, user_id: int, chat_id: int, tag: Tag) -> None:
         """Delete a specific tag."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            existing_tag = session.query(DbTag).filter_by(
-                name=tag.name,
-                chat_id=chat_id
-            ).first()
+        async with self._session_scope('delete_tag') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            existing_tag = await self._get_tag(session, chat_id, tag)
             if not existing_tag:
                 raise NotFoundException(f"Тег {tag.name} \
                                         в чате {chat_id} не найден")
-            session.delete(existing_tag)
+            await session.delete(existing_tag)
 
-    def get_message_tags(self, user_id: int, chat_id: int, message_id: str) -> List[Tag]:
+    async def get_message_tags(self, user_id: int, chat_id: int, message_id: str) -> List[Tag]:
         """Get all tags associated with a specific message."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            message_tags = session.query(DbMessageTag).filter_by(
-                message_id=message_id,
-                tag_chat_id=chat_id
-            ).all()
+        async with self._session_scope('get_message_tags') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            tag_names = (await session.scalars(
+                select(DbTag.name)
+                .join(DbMessageTag)
+                .where(DbMessageTag.message_id == message_id,
+                       DbTag.chat_id == chat_id)
+            )).all()
             return [
-                Tag(name=mt.tag_name)
-                for mt in message_tags
+                Tag(name=name)
+                for name in tag_names
             ]
 
-    def remove_tag_from_message(self, user_id: int, chat_id: int, 
-                               tag: Tag, message_id: str) -> None:
+    async def remove_tag_from_message(self, user_id: int, chat_id: int,
+                                      tag: Tag, message_id: str) -> None:
         """Remove a specific tag from a specific message."""
-        with self._session_scope() as session:
-            self._ensure_user_in_chat(user_id, chat_id, session)
-            
-            message_tag = session.query(DbMessageTag).filter_by(
-                message_id=message_id,
-                tag_name=tag.name,
-                tag_chat_id=chat_id
-            ).first()
+        async with self._session_scope('remove_tag_from_message') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+
+            db_tag = await self._get_tag(session, chat_id, tag)
+            message_tag = db_tag and await session.get(
+                DbMessageTag, (db_tag.id, message_id))
             if not message_tag:
                 raise NotFoundException(f"Тег {tag.name} не присвоен сообщению {message_id}")
-            session.delete(message_tag) 
-            # Проверяем, нужно ли удалять тег полностью
-            tag_usage_count = session.query(DbMessageTag).filter_by(
-                tag_name=tag.name, 
-                tag_chat_id=chat_id
-            ).count()
-            if tag_usage_count == 0:
-                db_tag = session.query(DbTag).filter_by(
-                    name=tag.name,
-                    chat_id=chat_id
-                ).first()
-                if db_tag:
-                    session.delete(db_tag)
-    
-    def delete_message(self, user_id: int,
-                                 chat_id: int, message_id: str) -> None:
-        """Delete a specific message from a specific chat 
+            await session.delete(message_tag)
+            await session.flush()
+            # Тег удаляется полностью, если больше ни у кого его нет
+            await self._release_tags(session, {db_tag.id: 1})
+
+    async def delete_message(self, user_id: int,
+                             chat_id: int, message_id: str) -> None:
+        """Delete a specific message from a specific chat
         (with deleting of tags relations and orphan tags )."""
-        with self._session_scope() as session:
-            # получаем все теги сообщения
-            message_tags = session.query(DbMessageTag).filter_by(
-                message_id=message_id,
-                tag_chat_id=chat_id
-            ).all()
-            # если у сообщения нет тегов, больше ничего не требуется
-            if not message_tags:
-                return
-            tag_names = [mt.tag_name for mt in message_tags]
-            # массовое удаление связей между сообщением и тегами
-            (session.query(DbMessageTag)
-                    .filter(DbMessageTag.message_id == message_id,
-                            DbMessageTag.tag_chat_id == chat_id)
-                    .delete(synchronize_session=False))
-            # теги которые используются другими сообщениями удалять не нужно, 
-            # но остальные нужно
-            still_used_tags = (session.query(DbMessageTag.tag_name)
-                            .filter(DbMessageTag.tag_name.in_(tag_names),
-                                    DbMessageTag.tag_chat_id == chat_id)
-                            .distinct()
-                            .all())
-            used_tag_names = {tag[0] for tag in still_used_tags}
-            unused_tag_names = set(tag_names) - used_tag_names
-            # массовое удаление неиспользуемых тегов
-            if unused_tag_names:
-                (session.query(DbTag)
-                .filter(DbTag.name.in_(unused_tag_names),
-                        DbTag.chat_id == chat_id)
-                .delete(synchronize_session=False))
\ No newline at end of file
+        async with self._session_scope('delete_message') as session:
+            await session.execute(
+                delete(DbMessageText)
+                .where(DbMessageText.chat_id == chat_id,
+                       DbMessageText.message_id == message_id)
+            )
+            # массовое удаление связей между сообщением и тегами,
+            # RETURNING сразу отдаёт затронутые теги
+            deleted = await session.execute(
+                delete(DbMessageTag)
+                .where(DbMessageTag.message_id == message_id,
+                       DbMessageTag.tag_id.in_(
+                           select(DbTag.id).where(DbTag.chat_id == chat_id)))
+                .returning(DbMessageTag.tag_id)
+            )
+            tag_ids = [tag_id for (tag_id,) in deleted.all()]
+            # счётчики затронутых тегов уменьшаются одним запросом,
+            # неиспользуемые теги удаляются без подсчёта связей
+            await self._release_tags(session, Counter(tag_ids))
+
+    async def save_message_text(self, user_id: int, chat_id: int, message_id: str,
+                                text: str, source: str) -> None:
+        """Store searchable text of a message, replacing the previous
+        text from the same `source`."""
+        async with self._session_scope('save_message_text') as session:
+            await self._ensure_user_in_chat(user_id, chat_id, session)
+            await session.merge(DbMessageText(chat_id=chat_id, message_id=message_id,
+                                              source=source, text=text))
+
+    async def search_messages(self, user_id: int, query: str, limit: int = 10,
+                              chat_id: Optional[int] = None,
+                              tags: Optional[List[Tag]] = None,
+                              tag_op: TagOperation = TagOperation.AND) -> List[Message]:
+        """Return messages from the user's chats whose text matches `query`,
+        best matches first. With `chat_id` only that chat is searched and
+        `tags` further limit the result to messages having them."""
+        if not query.split():
+            return []
+        async with self._session_scope('search_messages') as session:
+            # Текст, теги и доступ пользователя проверяются одним запросом
+            user_chat_ids = select(DbUserChat.chat_id).where(DbUserChat.user_id == user_id)
+            search_query = (search_message_text(session, query)
+                            .where(DbMessageText.chat_id.in_(user_chat_ids)))
+            if chat_id is not None:
+                search_query = search_query.where(DbMessageText.chat_id == chat_id)
+                if tags:
+                    tag_names = list(dict.fromkeys(tag.name for tag in tags))
+                    tagged_ids = (select(DbMessageTag.message_id)
+                                  .join(DbTag)
+                                  .where(DbTag.chat_id == chat_id,
+                                         DbTag.name.in_(tag_names))
+                                  .group_by(DbMessageTag.message_id))
+                    if tag_op == TagOperation.AND:
+                        tagged_ids = tagged_ids.having(
+                            func.count(DbMessageTag.tag_id.distinct()) == len(tag_names))
+                    search_query = search_query.where(DbMessageText.message_id.in_(tagged_ids))
+            found = (await session.execute(search_query.limit(limit))).all()
+            return [
+                Message(
+                    message_id=mid,
+                    chat_id=found_chat_id
+                ) for found_chat_id, mid in found
+            ]
@@ -0,0 +1,139 @@
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, List, Optional
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+
+from sql_adapters.instrumentation import db_operation
+
+
+_current: ContextVar[Optional['UnitOfWork']] = ContextVar('unit_of_work', default=None)
+
+
+def current_unit_of_work() -> Optional['UnitOfWork']:
+    """Return the unit of work open in the current context, if any."""
+    unit = _current.get()
+    return unit if unit is not None and not unit.closed else None
+
+
+def after_commit(callback: Callable[[], None]) -> None:
+    """
+    Call `callback` once the current unit's transaction is committed, or
+    at once outside a unit of work. Dropped if the unit rolls back, so
+    in-process caches never keep what the database doesn't have.
+    """
+    unit = current_unit_of_work()
+    if unit is None:
+        callback()
+    else:
+        unit._after_commit.append(callback)
+
+
+async def commit_now() -> None:
+    """
+    Commit the work of the current unit so far and return its connection
+    to the pool. Does nothing outside a unit of work, where every
+    manager call commits by itself.
+    """
+    unit = current_unit_of_work()
+    if unit is not None:
+        await unit.commit()
+
+
+@asynccontextmanager
+async def outside_transaction() -> AsyncIterator[None]:
+    """
+    Run the block, e.g. a network call, without holding a transaction:
+    the work of the current unit so far is committed and its connection
+    is returned to the pool. Does nothing outside a unit of work.
+    """
+    await commit_now()
+    yield
+
+
+class UnitOfWork:
+    """
+    Database transaction shared by the manager calls made while handling
+    an update.
+
+    While the unit is open, `_session_scope` of the SQL managers joins its
+    session instead of opening and committing a session of its own, so
+    the managers' interfaces stay the same. The session is opened on the
+    first manager call and committed when the unit exits, or rolled back
+    if it exits with an exception. Each call runs in a savepoint, so a
+    call that raises leaves nothing behind even if the error is caught. Network calls in between are wrapped
+    in `outside_transaction`, which commits early, so that no connection
+    and no row locks are held while waiting for other services: the
+    manager calls between two network calls share one transaction.
+    Manager calls made after the unit exits, e.g. by background tasks
+    started during the update, fall back to their own transactions.
+    """
+    def __init__(self, sess_maker: async_sessionmaker):
+        self.sess_maker = sess_maker
+        self.session: Optional[AsyncSession] = None
+        self.closed = False
+        # AsyncSession can't be used concurrently, and tasks started
+        # during the update may call managers at the same time
+        self._lock = asyncio.Lock()
+        self._token = None
+        self._after_commit: List[Callable[[], None]] = []
+
+    async def __aenter__(self) -> 'UnitOfWork':
+        self._token = _current.set(self)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        async with self._lock:
+            self.closed = True
+            await self._finish(commit=exc_type is None)
+
+    async def commit(self) -> None:
+        """Commit the work done so far and release the connection.
+        The next manager call starts a new transaction."""
+        async with self._lock:
+            await self._finish(commit=True)
+
+    async def _finish(self, commit: bool) -> None:
+        session, self.session = self.session, None
+        callbacks, self._after_commit = self._after_commit, []
+        if session is None:
+            return
+        try:
+            with db_operation('UnitOfWork.commit' if commit else 'UnitOfWork.rollback'):
+                if commit:
+                    await session.commit()
+                else:
+                    await session.rollback()
+                    return
+        finally:
+            await session.close()
+        for callback in callbacks:
+            callback()
+
+    @asynccontextmanager
+    async def scope(self) -> AsyncIterator[AsyncSession]:
+        """Give a manager call exclusive use of the shared session."""
+        async with self._lock:
+            if self.closed:
+                # Unit закрылся, пока вызов ждал своей очереди
+                async with self.sess_maker() as session, session.begin():
+                    yield session
+                return
+            if self.session is None:
+                self.session = self.sess_maker()
+            # Failed call is undone on its own, like outside a unit,
+            # and the work of the other calls is kept
+            savepoint = await self.session.begin_nested()
+            callbacks = len(self._after_commit)
+            try:
+                yield self.session
+                # autoflush выключен: следующие вызовы в этой же транзакции
+                # должны видеть изменения, а ошибки БД - всплывать здесь
+                await self.session.flush()
+            except BaseException:
+                await savepoint.rollback()
+                del self._after_commit[callbacks:]
+                raise
+            await savepoint.commit()
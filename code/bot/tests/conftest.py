@@ -0,0 +1,7 @@
+import pytest
+
+
+@pytest.fixture
+def db_url(tmp_path) -> str:
+    """URL of an empty SQLite database file, migrated by `init_db`."""
+    return f"sqlite+aiosqlite:///{tmp_path / 'bot.sqlite3'}"
@@ -0,0 +1,31 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+
+@contextmanager
+def recorded_statements(sess_maker: async_sessionmaker) -> Iterator[List[Tuple[str, tuple]]]:
+    """Collect (statement, parameters) of everything executed in the block."""
+    statements: List[Tuple[str, tuple]] = []
+    engine = sess_maker.kw['bind'].sync_engine
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def query_plan(db_url: str, statement: str, parameters: tuple) -> List[str]:
+    """Details of SQLite's EXPLAIN QUERY PLAN for a statement."""
+    conn = sqlite3.connect(db_url.split('///', 1)[1])
+    try:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + statement, parameters)]
+    finally:
+        conn.close()
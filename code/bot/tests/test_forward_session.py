@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from models import Tag
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.models import DbSessionMessage
+from sql_adapters.sessions import SQLSessionManager
+from sql_adapters.tags import SQLTagManager
+from sql_adapters.unit_of_work import UnitOfWork
+from ui.tag_bot.routes.get_messages import GetMessagesRoute
+
+
+class CrashingForwarder:
+    """Sends `sent` messages, then fails like a bot that is stopped."""
+    def __init__(self, sent: int):
+        self.sent = sent
+
+    async def forward(self, chat_id, mids, on_sent=None):
+        for mid in mids[:self.sent]:
+            await on_sent(f'fwd-{mid}')
+        raise RuntimeError('bot stopped')
+
+
+class Event:
+    def get_ids(self):
+        return 1, 10
+
+
+def test_sent_messages_are_in_session_even_if_forwarding_fails(db_url):
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        sessions = SQLSessionManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        await tags.add_tags_to_many(10, 1, [Tag('t')], ['m1', 'm2', 'm3'])
+        route = GetMessagesRoute(tag_manager=tags, session_manager=sessions,
+                                 forwarder=CrashingForwarder(sent=2))
+        with pytest.raises(RuntimeError):
+            async with UnitOfWork(sess_maker):
+                await route.handle(Event(), {'chat_id': ['1'], 'tag': ['t']})
+        async with sess_maker() as session:
+            recorded = (await session.scalars(select(DbSessionMessage.message_id))).all()
+        await sess_maker.kw['bind'].dispose()
+        return recorded
+
+    assert sorted(asyncio.run(scenario())) == ['fwd-m1', 'fwd-m2']
@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from models import Tag
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db, pool_stats
+from sql_adapters.tags import SQLTagManager
+from sql_adapters.unit_of_work import UnitOfWork
+
+
+def _slow_queries(caplog):
+    return [record.getMessage() for record in caplog.records
+            if record.name == 'sql_adapters.instrumentation']
+
+
+def test_slow_queries_name_manager_method_inside_unit(db_url, caplog):
+    async def scenario():
+        sess_maker = await init_db(db_url, slow_query_threshold=0.0)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        caplog.clear()
+        async with UnitOfWork(sess_maker):
+            await tags.add_tags(10, 1, [Tag('a'), Tag('b')], 'm1')
+        await sess_maker.kw['bind'].dispose()
+
+    with caplog.at_level(logging.WARNING, logger='sql_adapters.instrumentation'):
+        asyncio.run(scenario())
+    messages = _slow_queries(caplog)
+    assert any('in SQLTagManager.add_tags: INSERT INTO message_tag' in m for m in messages)
+    assert not any(' in unknown:' in m for m in messages)
+
+
+def test_pool_stats_count_checkouts(db_url):
+    async def scenario():
+        sess_maker = await init_db(db_url, pool_size=2, max_overflow=0)
+        chats = SQLChatManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await asyncio.gather(*(chats.get_chat(1) for _ in range(6)))
+        stats = pool_stats(sess_maker)
+        await sess_maker.kw['bind'].dispose()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats['checkouts'] == 7
+    assert stats['size'] == 2 and stats['checked_out'] == 0
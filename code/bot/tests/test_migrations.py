@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, inspect, text
+
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import BASELINE_REVISION, MIGRATIONS_CONFIG, init_db
+from sql_adapters.tags import SQLTagManager
+
+
+def _create_pre_migration_db(db_url: str, *statements: str) -> None:
+    """Schema of a database made by create_all before migrations existed,
+    with what create_all or the operator added to it later."""
+    engine = create_engine(db_url.replace('+aiosqlite', ''))
+    with engine.connect() as conn:
+        config = Config(MIGRATIONS_CONFIG)
+        config.attributes['connection'] = conn
+        command.upgrade(config, BASELINE_REVISION)
+        conn.execute(text('DROP TABLE alembic_version'))
+        for statement in statements:
+            conn.execute(text(statement))
+        conn.commit()
+    engine.dispose()
+
+
+def _migrate(db_url: str) -> dict:
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        engine = sess_maker.kw['bind']
+        async with engine.connect() as conn:
+            columns = await conn.run_sync(lambda c: {
+                table: {column['name'] for column in inspect(c).get_columns(table)}
+                for table in ('chat_session_messages', 'tag')})
+        await engine.dispose()
+        return columns
+
+    return asyncio.run(scenario())
+
+
+@pytest.mark.parametrize('by_hand', [
+    (),
+    ('ALTER TABLE chat_session_messages '
+     'ADD COLUMN pending_deletion BOOLEAN NOT NULL DEFAULT false',),
+], ids=['missing', 'added_by_hand'])
+def test_migrations_add_pending_deletion_to_pre_migration_db(db_url, by_hand):
+    _create_pre_migration_db(db_url, *by_hand)
+    assert 'pending_deletion' in _migrate(db_url)['chat_session_messages']
+
+
+@pytest.mark.parametrize('by_hand', [
+    (),
+    ('ALTER TABLE tag ADD COLUMN usage_count INTEGER NOT NULL DEFAULT 0',
+     'ALTER TABLE tag ADD COLUMN last_used_at TIMESTAMP'),
+], ids=['missing', 'added_by_hand'])
+def test_migrations_add_tag_usage_columns_to_pre_migration_db(db_url, by_hand):
+    _create_pre_migration_db(db_url, *by_hand)
+    assert {'usage_count', 'last_used_at'} <= _migrate(db_url)['tag']
+
+
+def test_migrations_keep_message_text_created_by_create_all(db_url):
+    _create_pre_migration_db(
+        db_url,
+        'CREATE TABLE message_text (chat_id BIGINT NOT NULL REFERENCES chat (id) ON DELETE CASCADE, '
+        'message_id VARCHAR NOT NULL, source VARCHAR(16) NOT NULL, text TEXT NOT NULL, '
+        'PRIMARY KEY (chat_id, message_id, source))',
+        "CREATE VIRTUAL TABLE message_text_fts "
+        "USING fts5(text, content='message_text', content_rowid='rowid')")
+
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        await tags.save_message_text(10, 1, 'm1', 'invoice total', source='ocr')
+        found = await tags.search_messages(10, 'invoice')
+        await sess_maker.kw['bind'].dispose()
+        return found
+
+    assert [message.message_id for message in asyncio.run(scenario())] == ['m1']
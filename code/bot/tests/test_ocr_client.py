@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from ocr_http_adapter.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ocr_http_adapter.ocr import httpOCR
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_route('*', '/{tail:.*}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    host, port = runner.addresses[0][:2]
+    return runner, f'http://{host}:{port}'
+
+
+def _run(handler, scenario):
+    async def main():
+        runner, base_url = await _serve(handler)
+        client = httpOCR(base_url, breaker=CircuitBreaker(failure_threshold=1))
+        try:
+            await scenario(client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_invalid_json_opens_circuit():
+    async def handler(request):
+        return web.Response(text='<html>bad gateway</html>', content_type='application/json')
+
+    async def scenario(client):
+        with pytest.raises(ValueError):
+            await client.get_transcription_by_url('http://img')
+        with pytest.raises(CircuitOpenError):
+            await client.get_transcription_by_url('http://img')
+
+    _run(handler, scenario)
+
+
+def test_server_errors_open_circuit_but_client_errors_do_not():
+    async def handler(request):
+        return web.Response(status=int(request.query['status']), text='error')
+
+    async def scenario(client):
+        for _ in range(3):
+            with pytest.raises(Exception, match='OCR service error'):
+                await client._request('GET', '/jobs/1?status=404')
+        with pytest.raises(Exception, match='OCR service error'):
+            await client._request('GET', '/jobs/1?status=503')
+        with pytest.raises(CircuitOpenError):
+            await client._request('GET', '/jobs/1?status=404')
+
+    _run(handler, scenario)
+
+
+def test_cancelled_calls_are_not_failures():
+    async def handler(request):
+        await asyncio.sleep(0.5)
+        return web.json_response({'text': ''})
+
+    async def cancel_call(client):
+        call = asyncio.create_task(client.get_transcription_by_url('http://img'))
+        await asyncio.sleep(0.1)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    async def scenario(client):
+        await cancel_call(client)
+        assert client.breaker.allow()
+        # A cancelled trial call lets the next one try again
+        client.breaker.reset_timeout = 0
+        client.breaker.record_failure()
+        await cancel_call(client)
+        assert client.breaker.allow()
+
+    _run(handler, scenario)
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from models import Tag, TagOperation
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.sessions import SQLSessionManager
+from sql_adapters.tags import SQLTagManager
+from tests.db_helpers import query_plan, recorded_statements
+
+
+async def _seed(sess_maker) -> None:
+    chats = SQLChatManager(sess_maker)
+    tags = SQLTagManager(sess_maker)
+    sessions = SQLSessionManager(sess_maker)
+    for chat_id in (1, 2):
+        await chats.add_chat(chat_id, f'chat {chat_id}')
+        for user_id in range(10, 20):
+            await chats.remember_user(user_id, chat_id, is_main=chat_id == 1)
+        await tags.add_tags_to_many(10, chat_id, [Tag('work'), Tag('todo')],
+                                    [f'm{chat_id}-{i}' for i in range(20)])
+        await sessions.update_session(10, chat_id, [f's{chat_id}-{i}' for i in range(20)])
+
+
+# Hot paths and the tables each of them must reach through an index
+HOT_PATHS = {
+    'get_chat_users': (lambda m: m['chats'].get_chat_users(1), ['user_chat']),
+    'get_main_chat': (lambda m: m['chats'].get_main_chat(10), ['user_chat']),
+    'end_session': (lambda m: m['sessions'].end_session(1), ['chat_session_messages']),
+    'get_messages': (lambda m: m['tags'].get_messages(10, 1, Tag('work')),
+                     ['tag', 'message_tag']),
+    'get_message_tags': (lambda m: m['tags'].get_message_tags(10, 1, 'm1-3'),
+                         ['tag', 'message_tag']),
+    'get_messages_page': (lambda m: m['tags'].get_messages_page(10, 1, [Tag('work'), Tag('todo')], TagOperation.AND,
+                                                                limit=5),
+                          ['tag', 'message_tag']),
+}
+
+
+@pytest.mark.parametrize('name', sorted(HOT_PATHS))
+def test_hot_path_uses_indexes(db_url, name):
+    call, tables = HOT_PATHS[name]
+
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        await _seed(sess_maker)
+        managers = {'chats': SQLChatManager(sess_maker),
+                    'tags': SQLTagManager(sess_maker),
+                    'sessions': SQLSessionManager(sess_maker)}
+        with recorded_statements(sess_maker) as statements:
+            await call(managers)
+        await sess_maker.kw['bind'].dispose()
+        return statements
+
+    statements = asyncio.run(scenario())
+    checked = set()
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            continue
+        plan = query_plan(db_url, statement, parameters)
+        for table in tables:
+            assert f'SCAN {table}' not in plan, (statement, plan)
+            if any(f'SEARCH {table} ' in step for step in plan):
+                checked.add(table)
+    assert checked == set(tables), statements
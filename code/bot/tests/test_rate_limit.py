@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+import pytest
+
+from delivery.rate_limit import TokenBucket
+
+
+@pytest.mark.parametrize('rate', [0, -1])
+def test_token_bucket_rejects_non_positive_rate(rate):
+    with pytest.raises(ValueError):
+        TokenBucket(rate=rate)
+
+
+def test_token_bucket_spaces_concurrent_waiters_by_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        done = []
+
+        async def take(n):
+            await bucket.acquire()
+            done.append((n, time.monotonic() - started))
+
+        await asyncio.gather(*(take(n) for n in range(5)))
+        return done
+
+    done = asyncio.run(scenario())
+    # первый токен есть сразу, остальные приходят раз в 1/50 секунды
+    assert [n for n, _ in done] == list(range(5))
+    assert done[-1][1] >= 4 / 50 * 0.9
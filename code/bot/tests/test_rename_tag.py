@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from models import Tag
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.tags import SQLTagManager
+from tests.db_helpers import recorded_statements
+
+
+def _merge(db_url: str, messages: int):
+    """Merge tag `old` of `messages` messages into `new`, which already
+    tags every other one of them. Returns executed statements and tags."""
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        mids = [f'm{i}' for i in range(messages)]
+        await tags.add_tags_to_many(10, 1, [Tag('old')], mids)
+        await tags.add_tags_to_many(10, 1, [Tag('new')], mids[::2])
+        with recorded_statements(sess_maker) as statements:
+            await tags.rename_tag(10, 1, Tag('old'), Tag('new'))
+        result = (await tags.get_tags(10, 1), len(await tags.get_messages(10, 1, Tag('new'))))
+        await sess_maker.kw['bind'].dispose()
+        return statements, result
+
+    return asyncio.run(scenario())
+
+
+def test_merge_statement_count_does_not_grow(tmp_path):
+    small, _ = _merge(f"sqlite+aiosqlite:///{tmp_path / 'small.sqlite3'}", 10)
+    large, _ = _merge(f"sqlite+aiosqlite:///{tmp_path / 'large.sqlite3'}", 1000)
+    assert len(small) == len(large)
+    assert [statement for statement, _ in small] == [statement for statement, _ in large]
+
+
+@pytest.mark.parametrize('messages', [1, 10, 1000])
+def test_merge_moves_all_messages(db_url, messages):
+    _, (tags, tagged) = _merge(db_url, messages)
+    assert tags == [Tag('new')]
+    assert tagged == messages
+
+
+def test_rename_to_unused_name_updates_one_row(db_url):
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        await tags.add_tags_to_many(10, 1, [Tag('old')], [f'm{i}' for i in range(100)])
+        with recorded_statements(sess_maker) as statements:
+            await tags.rename_tag(10, 1, Tag('old'), Tag('fresh'))
+        await sess_maker.kw['bind'].dispose()
+        return statements
+
+    writes = [statement for statement, _ in asyncio.run(scenario())
+              if statement.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+    assert writes == ['UPDATE tag SET name=? WHERE tag.id = ?']
@@ -0,0 +1,77 @@
+import asyncio
+
+from maxapi.exceptions import MaxApiError
+
+from delivery.cleanup import SessionCleaner
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.sessions import SQLSessionManager
+
+
+class FlakyBot:
+    """Fails to delete each message `failures` times with a 503."""
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = {}
+
+    async def delete_message(self, mid):
+        self.calls[mid] = self.calls.get(mid, 0) + 1
+        if self.calls[mid] <= self.failures:
+            raise MaxApiError(503, 'unavailable')
+
+
+class Sessions:
+    def __init__(self):
+        self.removed = []
+
+    async def claim_pending_deletions(self):
+        return []
+
+    async def remove_session_messages(self, messages):
+        self.removed.extend(messages)
+
+
+def test_still_failing_messages_are_retried_after_backoff():
+    async def scenario():
+        bot, sessions = FlakyBot(failures=3), Sessions()
+        # без повторов внутри call_with_retry, только отложенные
+        cleaner = SessionCleaner(bot, sessions, retries=0, retry_delay=0.01)
+        await cleaner.start()
+        cleaner.schedule(1, ['m1', 'm2'])
+        for _ in range(200):
+            if len(sessions.removed) == 2:
+                break
+            await asyncio.sleep(0.01)
+        await cleaner.stop()
+        return bot.calls, sessions.removed
+
+    calls, removed = asyncio.run(scenario())
+    assert sorted(removed) == [(1, 'm1'), (1, 'm2')]
+    assert calls == {'m1': 4, 'm2': 4}
+
+
+def test_pending_deletions_are_claimed_by_one_replica(db_url):
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        # реплика, завершившая сессию, держит аренду; другие её не видят
+        ending = SQLSessionManager(sess_maker)
+        other = SQLSessionManager(sess_maker)
+        await ending.update_session(10, 1, ['m1', 'm2'])
+        ended = await ending.end_session(1)
+        while_leased = await other.claim_pending_deletions()
+        # аренда истекла, как после падения реплики
+        expired = SQLSessionManager(sess_maker, deletion_lease=-1)
+        await expired.update_session(10, 1, ['m3'])
+        await expired.end_session(1)
+        claims = await asyncio.gather(other.claim_pending_deletions(),
+                                      SQLSessionManager(sess_maker).claim_pending_deletions())
+        await sess_maker.kw['bind'].dispose()
+        return ended, while_leased, claims
+
+    ended, while_leased, claims = asyncio.run(scenario())
+    assert sorted(ended) == ['m1', 'm2']
+    assert while_leased == []
+    assert sorted(claims[0] + claims[1]) == [(1, 'm3')]
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from models import Tag, TagGroup, TagNot, TagOperation, TagTerm
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.tags import SQLTagManager
+from ui.tag_bot.tag_query import TagQuerySyntaxError, parse_tag_query
+
+
+def _term(name: str) -> TagTerm:
+    return TagTerm(Tag(name))
+
+
+def _and(*operands) -> TagGroup:
+    return TagGroup(TagOperation.AND, list(operands))
+
+
+def _or(*operands) -> TagGroup:
+    return TagGroup(TagOperation.OR, list(operands))
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('work', _term('work')),
+    ('a & b | c', _or(_and(_term('a'), _term('b')), _term('c'))),
+    ('a | b & c', _or(_term('a'), _and(_term('b'), _term('c')))),
+    ('a b | c', _or(_and(_term('a'), _term('b')), _term('c'))),
+    ('a b & c', _and(_term('a'), _term('b'), _term('c'))),
+    ('!a & b', _and(TagNot(_term('a')), _term('b'))),
+    ('!!a', TagNot(TagNot(_term('a')))),
+    ('!(a | b)', TagNot(_or(_term('a'), _term('b')))),
+    ('a & (b | c)', _and(_term('a'), _or(_term('b'), _term('c')))),
+    ('((a))', _term('a')),
+    ('a&!b|(c d)', _or(_and(_term('a'), TagNot(_term('b'))), _and(_term('c'), _term('d')))),
+])
+def test_parse(text, expected):
+    assert parse_tag_query(text) == expected
+
+
+@pytest.mark.parametrize('text', ['', '   ', 'a &', '& a', 'a | | b', '!', '(a', 'a)', '()', 'a & (b | )'])
+def test_syntax_errors(text):
+    with pytest.raises(TagQuerySyntaxError):
+        parse_tag_query(text)
+
+
+MESSAGES = {
+    'm1': ['work', 'urgent'],
+    'm2': ['work', 'done'],
+    'm3': ['todo'],
+    'm4': ['work', 'todo'],
+    'm5': ['home'],
+}
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('work & urgent | todo', ['m1', 'm3', 'm4']),
+    ('work urgent', ['m1']),
+    ('work & (urgent | todo)', ['m1', 'm4']),
+    ('work & !done', ['m1', 'm4']),
+    ('!(work | todo)', ['m5']),
+    ('ghost', []),
+    ('work & ghost', []),
+    ('work | ghost', ['m1', 'm2', 'm4']),
+    # A tag nobody has is missing on every message
+    ('!ghost', ['m1', 'm2', 'm3', 'm4', 'm5']),
+    ('todo & !ghost', ['m3', 'm4']),
+])
+def test_query_matches_messages(db_url, text, expected):
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        for chat_id in (1, 2):
+            await chats.add_chat(chat_id, f'chat {chat_id}')
+            await chats.remember_user(10, chat_id)
+        for mid, names in MESSAGES.items():
+            await tags.add_tags(10, 1, [Tag(name) for name in names], mid)
+        # Tags of another chat never match
+        await tags.add_tags(10, 2, [Tag('work'), Tag('todo')], 'other')
+        page = await tags.get_messages_page_by_query(10, 1, parse_tag_query(text), limit=10)
+        await sess_maker.kw['bind'].dispose()
+        return page
+
+    page = asyncio.run(scenario())
+    assert [message.message_id for message in page.messages] == expected
+    assert page.total == len(expected)
@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from exceptions import AlreadyExistsException
+from models import Tag
+from sql_adapters.chats import SQLChatManager
+from sql_adapters.db import init_db
+from sql_adapters.models import DbTag
+from sql_adapters.tags import SQLTagManager
+from sql_adapters.unit_of_work import UnitOfWork
+
+
+def test_failed_call_inside_unit_is_rolled_back(db_url):
+    async def scenario():
+        sess_maker = await init_db(db_url)
+        chats = SQLChatManager(sess_maker)
+        tags = SQLTagManager(sess_maker)
+        await chats.add_chat(1, 'chat')
+        await chats.remember_user(10, 1)
+        await tags.add_tags(10, 1, [Tag('d')], 'm1')
+        async with UnitOfWork(sess_maker):
+            await tags.add_tags(10, 1, [Tag('e')], 'm2')
+            # 'f' is created and assigned before 'd' turns out to be there
+            with pytest.raises(AlreadyExistsException):
+                await tags.add_tags(10, 1, [Tag('f'), Tag('d')], 'm1')
+        async with sess_maker() as session:
+            usage = dict((await session.execute(select(DbTag.name, DbTag.usage_count))).all())
+        messages = await tags.get_messages(10, 1, Tag('f'))
+        await sess_maker.kw['bind'].dispose()
+        return usage, messages
+
+    usage, messages = asyncio.run(scenario())
+    # Work of the other calls in the unit is kept
+    assert usage == {'d': 1, 'e': 1}
+    assert messages == []
@@ -0,0 +1,48 @@
+import asyncio
+import random
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from maxapi import Bot, Dispatcher
+
+from ingest.webhook import QueuedWebhook
+
+
+class RecordingWebhook(QueuedWebhook):
+    """Dispatches updates after a random delay, like enrich_event does."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatched = []
+
+    async def _dispatch(self, event_json):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        self.dispatched.append((event_json['message']['recipient']['chat_id'],
+                                event_json['message']['body']['seq']))
+        return True
+
+
+def _update(chat_id: int, seq: int) -> dict:
+    return {'update_type': 'message_created',
+            'message': {'recipient': {'chat_id': chat_id}, 'body': {'seq': seq}}}
+
+
+def test_updates_of_one_chat_are_dispatched_in_arrival_order():
+    async def scenario():
+        webhook = RecordingWebhook(Dispatcher(), Bot('token'), workers=4)
+        app = web.Application()
+        webhook.setup(app, '/webhook')
+        # on_startup of the base class talks to the Max API
+        workers = [asyncio.create_task(webhook._worker(queue)) for queue in webhook._queues]
+        async with TestClient(TestServer(app)) as client:
+            for seq in range(20):
+                for chat_id in (1, 2, 3):
+                    response = await client.post('/webhook', json=_update(chat_id, seq))
+                    assert response.status == 200
+        await asyncio.gather(*(queue.join() for queue in webhook._queues))
+        for worker in workers:
+            worker.cancel()
+        return webhook.dispatched
+
+    dispatched = asyncio.run(scenario())
+    for chat_id in (1, 2, 3):
+        assert [seq for chat, seq in dispatched if chat == chat_id] == list(range(20))
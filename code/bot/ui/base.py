@@ -16,24 +16,31 @@ class ChatUI:
             raise ValueError('Route not found')
         route: BaseRoute = self.routes[route_name]
         
-        handle_method = route.handle
-        if asyncio.iscoroutinefunction(handle_method):
-            await handle_method(event, args)
-        else:
-            handle_method(event, args)
+        await self._call(route.handle, event, args)
 
         response = {}
-        response['text'] = route.build_text(event, args)
+        response['text'] = await self._call(route.build_text, event, args)
         response['attachments'] = []
-        buttons = route.build_buttons(event, args)
+        buttons = await self._call(route.build_buttons, event, args)
         if buttons != [[]]:
-            buttons_payload = ButtonsPayload(buttons=route.build_buttons(event, args)).pack()
+            buttons_payload = ButtonsPayload(buttons=buttons).pack()
             response['attachments'].append(buttons_payload)
 
         # === Images ===
         # TODO
 
         return response
+
+    async def after_send(self, event: UpdateUnion, route_name: str, args: dict, sent_message) -> None:
+        """Let the route act on the message that was sent with its response."""
+        await self._call(self.routes[route_name].after_send, event, args, sent_message)
+
+    @staticmethod
+    async def _call(method, event: UpdateUnion, *args):
+        """Call a route method, awaiting it if it is a coroutine function."""
+        if asyncio.iscoroutinefunction(method):
+            return await method(event, *args)
+        return method(event, *args)
     
     def extract_message_created_payload(self, event: MessageCreated) -> tuple[str, dict]:
         message_text = event.message.body.text.split()
@@ -62,6 +69,9 @@ class BaseRoute():
     
     def build_text(self, event: UpdateUnion, args):
         return ''
+
+    def after_send(self, event: UpdateUnion, args, sent_message):
+        return
     
     # def build_images():
     #    return []
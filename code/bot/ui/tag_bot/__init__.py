@@ -4,6 +4,7 @@ from interfaces.chats import BaseChatManager
 from interfaces.tags import BaseTagManager
 from interfaces.sessions import BaseSessionsManager
 from ocr_http_adapter.ocr import httpOCR
+from delivery.forwarder import MessageForwarder
 
 from ui.tag_bot.routes.greeting import GreetingRoute
 from ui.tag_bot.routes.start import StartRoute
@@ -13,6 +14,7 @@ from ui.tag_bot.routes.menu import MenuRoute
 from ui.tag_bot.routes.groups import GroupsRoute
 from ui.tag_bot.routes.add_tag import ReplyRoute
 from ui.tag_bot.routes.get_messages import GetMessagesRoute
+from ui.tag_bot.routes.search import SearchRoute
 
 from ui.tag_bot.routes.ocr import OCRRoute
 from ui.tag_bot.ui import TagBotUI
@@ -22,6 +24,7 @@ def build_ui(tag_manager: BaseTagManager,
              chat_manager: BaseChatManager,
              session_manager: BaseSessionsManager,
              ocr_client: httpOCR,
+             forwarder: MessageForwarder,
              bot: Bot) -> TagBotUI:
     """
     Build routes and return a UI object.
@@ -33,10 +36,13 @@ def build_ui(tag_manager: BaseTagManager,
         '/tags': TagsRoute(tag_manager=tag_manager),
         '/get_messages': GetMessagesRoute(tag_manager=tag_manager,
                                           session_manager=session_manager,
-                                          bot=bot),
+                                          forwarder=forwarder),
         '/groups': GroupsRoute(chat_manager=chat_manager),
         '/menu': MenuRoute(),
         '/add_tag': ReplyRoute(tag_manager=tag_manager),
-        '/ocr': OCRRoute(ocr_client=ocr_client),
+        '/search': SearchRoute(tag_manager=tag_manager,
+                               session_manager=session_manager,
+                               forwarder=forwarder),
+        '/ocr': OCRRoute(ocr_client=ocr_client, tag_manager=tag_manager, bot=bot),
     }
     return TagBotUI(routes=routes)
@@ -10,7 +10,7 @@ class ReplyRoute(BaseRoute):
         super().__init__(*args, **kwargs)
         self.tag_manager = tag_manager
 
-    def handle(self, event, args):
+    async def handle(self, event, args):
         link = event.message.link
         if not (isinstance(link, LinkedMessage) and link.type == MessageLinkType.REPLY):
             print("ReplyRoute: No reply link found in the message.")
@@ -19,8 +19,16 @@ class ReplyRoute(BaseRoute):
         tag_values = args.get("tag", [])
         tags = [Tag(name=t) for t in tag_values]
 
-        self.tag_manager.add_tags(user_id=event.get_ids()[1], chat_id=event.get_ids()[0],
-                                 tags=tags, message_id=mid)
+        await self.tag_manager.add_tags(user_id=event.get_ids()[1], chat_id=event.get_ids()[0],
+                                        tags=tags, message_id=mid)
+        # Текст сообщения сохраняется сразу, чтобы искать по нему
+        # без обращений к Max API за каждым сообщением
+        if link.message.text:
+            await self.tag_manager.save_message_text(user_id=event.get_ids()[1],
+                                                     chat_id=event.get_ids()[0],
+                                                     message_id=mid,
+                                                     text=link.message.text,
+                                                     source='text')
         return
 
     def build_text(self, event, args: dict):
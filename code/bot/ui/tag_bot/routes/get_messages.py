@@ -1,56 +1,101 @@
-from maxapi.types import CallbackButton, NewMessageLink
-from maxapi.enums.message_link_type import MessageLinkType
-from maxapi.methods.types.sended_message import SendedMessage
-from maxapi import Bot
+from urllib.parse import urlencode
+
+from maxapi.types import CallbackButton
 
 from ui.base import BaseRoute
+from delivery.forwarder import MessageForwarder
 from interfaces.tags import BaseTagManager
 from interfaces.sessions import BaseSessionsManager
-from models import Tag, Message, TagOperation
+from sql_adapters.unit_of_work import commit_now, outside_transaction
+from models import Tag, Message, MessagePage, TagOperation
+from ui.tag_bot.tag_query import parse_tag_query, TagQuerySyntaxError
 
 
 class GetMessagesRoute(BaseRoute):
+    """
+    Expects `chat_id` and either one or more `tag` in `args`, optionally
+    with `op` for multiple tags, or `q` with a tag query like
+    `work & (urgent | todo) & !done`. `after` holds the cursor of the page to show.
+    `handle` puts the fetched `MessagePage` into `args['page']` for the builders,
+    or a query syntax error into `args['error']`.
+    """
     def __init__(self,
                  tag_manager: BaseTagManager,
                  session_manager: BaseSessionsManager,
-                 bot: Bot,
+                 forwarder: MessageForwarder,
+                 page_size: int = 10,
                  *args,
                  **kwargs):
         super().__init__(*args, **kwargs)
         self.session_manager = session_manager
         self.tag_manager = tag_manager
-        self.bot = bot
+        self.forwarder = forwarder
+        self.page_size = page_size
+
+    def _tag_op(self, args) -> TagOperation:
+        if 'op' in args and args['op'] and len(args['tag']) > 1:
+            return TagOperation(args['op'][0])
+        return TagOperation.AND
 
     async def handle(self, event, args):
         curr_chat_id, user_id = event.get_ids()
         chat_id = int(args['chat_id'][0])
-        tags = [Tag(name=tn) for tn in args['tag']]
-        if 'op' in args and args['op'] and len(args['tag']) > 1:
-            messages = self.tag_manager.get_messages_multitag(user_id=user_id,
-                                                                 chat_id=chat_id,
-                                                                 tags=tags,
-                                                                 tag_op=TagOperation(args['op']))
+        cursor = args['after'][0] if args.get('after') else None
+        if 'q' in args:
+            try:
+                query = parse_tag_query(args['q'][0])
+            except TagQuerySyntaxError as e:
+                args['error'] = str(e)
+                return
+            page: MessagePage = await self.tag_manager.get_messages_page_by_query(
+                user_id=user_id, chat_id=chat_id, query=query,
+                limit=self.page_size, cursor=cursor)
         else:
-            messages = self.tag_manager.get_messages(user_id=user_id, chat_id=chat_id, tag=tags[0])
-        
-        mids = [message.message_id for message in messages]
+            page = await self.tag_manager.get_messages_page(user_id=user_id,
+                                                            chat_id=chat_id,
+                                                            tags=[Tag(name=tn) for tn in args['tag']],
+                                                            tag_op=self._tag_op(args),
+                                                            limit=self.page_size,
+                                                            cursor=cursor)
+        args['page'] = page
+
+        mids = [message.message_id for message in page.messages]
         print(mids, flush=True)
 
-        sent_msg_ids = []
-        for mid in mids:
-            link = NewMessageLink(type=MessageLinkType.FORWARD, mid=mid)
-            sent_msg = await self.bot.send_message(chat_id=curr_chat_id, link=link)
-            if isinstance(sent_msg, SendedMessage):
-                sent_msg_ids.append(sent_msg.message.body.mid)
-        
-        self.session_manager.update_session(user_id, curr_chat_id, sent_msg_ids)
+        async def remember_sent(sent_mid: str):
+            # Committed at once: if the bot stops halfway, the messages
+            # already sent are still in the session and get cleaned up
+            await self.session_manager.update_session(user_id, curr_chat_id, [sent_mid])
+            await commit_now()
+
+        # No transaction is held while the messages are sent
+        async with outside_transaction():
+            await self.forwarder.forward(curr_chat_id, mids, on_sent=remember_sent)
 
     def build_text(self, event, args: dict):
-        if len(args['tag']) > 1:
-            return "⬆️ Собщения с тегами " + ' '.join(args['tag'])
-        return "⬆️ Собщения с тегом " + args['tag'][0]
+        if 'error' in args:
+            return "Не удалось разобрать запрос: " + args['error']
+        if 'q' in args:
+            text = "⬆️ Собщения по запросу " + args['q'][0]
+        elif len(args['tag']) > 1:
+            text = "⬆️ Собщения с тегами " + ' '.join(args['tag'])
+        else:
+            text = "⬆️ Собщения с тегом " + args['tag'][0]
+        page: MessagePage = args['page']
+        if page.next_cursor is not None or args.get('after'):
+            text += f" ({len(page.messages)} из {page.total})"
+        return text
 
     def build_buttons(self, event, args):
         chat_id = int(args['chat_id'][0])
         back_button_pl = f'/tags?chat_id={chat_id}'
-        return [[CallbackButton(text="Назад", payload=back_button_pl)]]
\ No newline at end of file
+        buttons = [[CallbackButton(text="Назад", payload=back_button_pl)]]
+        page: MessagePage | None = args.get('page')
+        if page is not None and page.next_cursor is not None:
+            query = {'chat_id': chat_id, 'after': page.next_cursor}
+            for key in ('tag', 'op', 'q'):
+                if key in args:
+                    query[key] = args[key]
+            next_button_pl = '/get_messages?' + urlencode(query, doseq=True)
+            buttons.insert(0, [CallbackButton(text="Ещё ➡️", payload=next_button_pl)])
+        return buttons
@@ -12,9 +12,9 @@ class GroupsRoute(BaseRoute):
     def build_text(self, event, args):
         return "Твои группы:"
 
-    def build_buttons(self, event, args):
+    async def build_buttons(self, event, args):
         try:
-            chats = self.chat_manager.get_ext_chats(event.get_ids()[1])
+            chats = await self.chat_manager.get_ext_chats(event.get_ids()[1])
         except NotFoundException:
             chats = []
 
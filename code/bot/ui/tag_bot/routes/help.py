@@ -23,10 +23,19 @@ class HelpRoute(BaseRoute):
             "➕ /add_tag <tag1> <tag2> ...\n"
             "Добавление одного или нескольких тегов к сообщению.\n"
             "• Используйте команду в ответ на сообщение, которое хотите пометить.\n\n"
+            "🔎 /get_messages <запрос>\n"
+            "Поиск сообщений текущего чата по тегам.\n"
+            "• & — и, | — или, ! — не, скобки задают порядок:\n"
+            "  /get_messages работа & (срочно | todo) & !готово\n\n"
             "🖼️🔍 /ocr\n"
             "Распознавание текста на изображении (OCR).\n"
             "• Ответьте командой /ocr на избранное сообщение с картинкой.\n"
             "• Бот извлечёт текст и отправит результат.\n"
+            "• Распознанный текст сохраняется для поиска.\n\n"
+            "🔍 /search <текст>\n"
+            "Поиск сообщений по тексту во всех ваших чатах.\n"
+            "• Слова с # — теги: /search отчёт #работа ищет только\n"
+            "  среди сообщений текущего чата с этими тегами.\n"
         )
     
     def build_buttons(self, event, args):
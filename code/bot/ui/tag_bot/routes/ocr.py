@@ -1,4 +1,12 @@
-from ocr_http_adapter.ocr import httpOCR
+import asyncio
+import logging
+
+from maxapi import Bot
+from maxapi.methods.types.sended_message import SendedMessage
+
+from interfaces.ocr import BaseOCR
+from interfaces.tags import BaseTagManager
+from sql_adapters.unit_of_work import outside_transaction
 from ui.base import BaseRoute
 from maxapi.types import MessageCreated
 from maxapi.types.message import LinkedMessage, MessageLinkType
@@ -7,16 +15,33 @@ from maxapi.types.attachments.attachment import PhotoAttachmentPayload
 from maxapi.types import CallbackButton
 
 
+logger = logging.getLogger(__name__)
+
+
 class OCRRoute(BaseRoute):
-    def __init__(self, ocr_client: httpOCR, *args, **kwargs):
+    """
+    `handle` queues an OCR job and puts the reply text into `args['text']`
+    for `build_text`. The reply says the image is being processed and is
+    edited in the background once the transcription arrives, and the
+    transcription is saved as searchable text of the image message.
+    """
+    def __init__(self, ocr_client: BaseOCR, tag_manager: BaseTagManager, bot: Bot,
+                 *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.ocr_client = ocr_client
+        self.tag_manager = tag_manager
+        self.bot = bot
+        # Keeps references to running delivery tasks
+        self._tasks = set()
 
     def build_buttons(self, event, args):
         return [[
             CallbackButton(text="Назад", payload="/menu")
         ]]
 
+    def _get_image_message_id(self, event: MessageCreated) -> str:
+        return event.message.link.message.mid
+
     def _get_image_url(self, event: MessageCreated) -> str | None:
         """Возвращает URL изображения или None, если его нет."""
         link = event.message.link
@@ -35,22 +60,58 @@ class OCRRoute(BaseRoute):
 
         return None
 
-    def build_text(self, event: MessageCreated, args):
+    async def handle(self, event: MessageCreated, args):
         image_url = self._get_image_url(event)
 
         if image_url is None:
-            return "Пожалуйста, отправь команду /ocr ответом на сообщение с изображением."
+            args['text'] = "Пожалуйста, отправь команду /ocr ответом на сообщение с изображением."
+            return
 
         print("DEBUG image_url:", image_url)
 
         try:
-            transcribed_text = self.ocr_client.get_transcription_by_url(
-                image_url)
-        except Exception as e:
-            return f"Не удалось распознать текст на изображении."
+            async with outside_transaction():
+                args['job_id'] = await self.ocr_client.submit_job(image_url)
+        except Exception:
+            logger.exception("Failed to submit OCR job for %s", image_url)
+            args['text'] = "Не удалось распознать текст на изображении."
+            return
 
+        args['text'] = "⏳ Распознаю текст на изображении..."
 
-        if not transcribed_text:
-            return "Текст на изображении не распознан."
+    def build_text(self, event: MessageCreated, args):
+        return args['text']
+
+    def after_send(self, event, args, sent_message: SendedMessage):
+        if 'job_id' not in args:
+            return
+        chat_id, user_id = event.get_ids()
+        task = asyncio.create_task(self._deliver(args['job_id'], sent_message.message.body.mid,
+                                                 user_id, chat_id,
+                                                 self._get_image_message_id(event)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, job_id: str, mid: str,
+                       user_id: int, chat_id: int, image_mid: str):
+        """Wait for the OCR job, put its result into the sent message
+        and save it for search."""
+        try:
+            transcribed_text = await self.ocr_client.wait_for_job(job_id)
+        except Exception as e:
+            logger.warning("OCR job %s failed: %s", job_id, e)
+            text = "Не удалось распознать текст на изображении."
+        else:
+            text = transcribed_text or "Текст на изображении не распознан."
+            if transcribed_text:
+                try:
+                    await self.tag_manager.save_message_text(user_id, chat_id, image_mid,
+                                                             transcribed_text, source='ocr')
+                except Exception:
+                    logger.exception("Failed to save OCR text of message %s", image_mid)
 
-        return transcribed_text
+        try:
+            # attachments=None keeps the buttons of the message
+            await self.bot.edit_message(message_id=mid, text=text)
+        except Exception:
+            logger.exception("Failed to edit message %s with OCR result", mid)
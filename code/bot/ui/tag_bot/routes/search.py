@@ -0,0 +1,73 @@
+from maxapi.types import CallbackButton
+
+from ui.base import BaseRoute
+from delivery.forwarder import MessageForwarder
+from interfaces.tags import BaseTagManager
+from interfaces.sessions import BaseSessionsManager
+from sql_adapters.unit_of_work import commit_now, outside_transaction
+from models import Tag
+
+
+class SearchRoute(BaseRoute):
+    """
+    `/search <query>`: forwards messages from the user's chats whose
+    saved text matches the query, best matches first. Words starting
+    with `#` are tags: with them only tagged messages of the current
+    chat having all of the tags are searched.
+    `handle` puts the found messages into `args['found']` for `build_text`.
+    """
+    def __init__(self,
+                 tag_manager: BaseTagManager,
+                 session_manager: BaseSessionsManager,
+                 forwarder: MessageForwarder,
+                 limit: int = 10,
+                 *args,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tag_manager = tag_manager
+        self.session_manager = session_manager
+        self.forwarder = forwarder
+        self.limit = limit
+
+    @staticmethod
+    def _words(args) -> list[str]:
+        # Слова команды приходят в args под номерами позиций
+        return [args[i][0] for i in sorted(k for k in args if isinstance(k, int))]
+
+    def _query(self, args) -> str:
+        return ' '.join(w for w in self._words(args) if not w.startswith('#'))
+
+    def _tags(self, args) -> list[Tag]:
+        return [Tag(name=w[1:]) for w in self._words(args) if w.startswith('#') and len(w) > 1]
+
+    async def handle(self, event, args):
+        curr_chat_id, user_id = event.get_ids()
+        query = self._query(args)
+        if not query:
+            return
+        tags = self._tags(args)
+        found = await self.tag_manager.search_messages(user_id=user_id, query=query,
+                                                       limit=self.limit,
+                                                       chat_id=curr_chat_id if tags else None,
+                                                       tags=tags)
+        args['found'] = found
+
+        async def remember_sent(sent_mid: str):
+            # Committed at once: if the bot stops halfway, the messages
+            # already sent are still in the session and get cleaned up
+            await self.session_manager.update_session(user_id, curr_chat_id, [sent_mid])
+            await commit_now()
+
+        # No transaction is held while the messages are sent
+        async with outside_transaction():
+            await self.forwarder.forward(curr_chat_id, [m.message_id for m in found], on_sent=remember_sent)
+
+    def build_text(self, event, args):
+        if 'found' not in args:
+            return "Использование: /search <текст для поиска> [#тег ...]"
+        if not args['found']:
+            return "🔍 Ничего не найдено по запросу: " + self._query(args)
+        return "⬆️ Найденные сообщения по запросу: " + self._query(args)
+
+    def build_buttons(self, event, args):
+        return [[CallbackButton(text="Назад", payload="/menu")]]
@@ -5,6 +5,7 @@ from exceptions import AlreadyExistsException
 
 from ui.base import *
 from interfaces.chats import BaseChatManager
+from sql_adapters.unit_of_work import outside_transaction
 
 
 class StartRoute(BaseRoute):
@@ -20,12 +21,13 @@ class StartRoute(BaseRoute):
     async def handle(self, event: UpdateUnion, args):
         chat_id, user_id = event.get_ids()
         try:
-            chat = await self.bot.get_chat_by_id(chat_id)
+            async with outside_transaction():
+                chat = await self.bot.get_chat_by_id(chat_id)
             chat_title = chat.title if chat.title is not None else ''
             is_main = chat.type is ChatType.DIALOG
 
-            self.chat_manager.add_chat(chat_id, chat_title)
-            self.chat_manager.remember_user(user_id, chat_id, is_main)
+            await self.chat_manager.add_chat(chat_id, chat_title)
+            await self.chat_manager.remember_user(user_id, chat_id, is_main)
         except AlreadyExistsException:
             print("Чат уже добавлен")
 
@@ -2,6 +2,7 @@ from maxapi.types import CallbackButton
 
 from ui.base import BaseRoute
 from interfaces.tags import BaseTagManager
+from models import TagOrder
 
 
 class TagsRoute(BaseRoute):
@@ -13,15 +14,15 @@ class TagsRoute(BaseRoute):
     def build_text(self, event, args: dict):
         return "Теги:"
 
-    def build_buttons(self, event, args):
+    async def build_buttons(self, event, args):
         curr_chat_id, user_id = event.get_ids()
         if 'chat_id' not in args:
             chat_id = curr_chat_id
         else:
             chat_id = int(args['chat_id'][0])
         
-        # Tag list
-        tags = self.tag_manager.get_tags(user_id, chat_id)
+        # Tag list, most used first: only the first page of them fits the grid
+        tags = await self.tag_manager.get_tags(user_id, chat_id, order=TagOrder.FREQUENCY)
         tag_names = [tag.name for tag in tags]
         tag_payloads = [f'/get_messages?chat_id={chat_id}&tag={tn}' for tn in tag_names]
 
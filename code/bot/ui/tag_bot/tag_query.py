@@ -0,0 +1,76 @@
+import re
+
+from models import Tag, TagOperation, TagQuery, TagTerm, TagNot, TagGroup
+
+
+class TagQuerySyntaxError(ValueError):
+    """Indicates that a tag query can't be parsed."""
+    pass
+
+
+_TOKEN = re.compile(r'\s*(?:([&|!()])|([^\s&|!()]+))')
+
+
+def _tokenize(text: str) -> list[str]:
+    tokens, pos = [], 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = _TOKEN.match(text, pos)
+        tokens.append(match.group(1) or match.group(2))
+        pos = match.end()
+    return tokens
+
+
+def parse_tag_query(text: str) -> TagQuery:
+    """
+    Parse a tag query like `work & (urgent | todo) & !done`.
+    `!` binds tighter than `&`, `&` tighter than `|`; tags written
+    next to each other without an operator are joined with `&`.
+    """
+    tokens = _tokenize(text)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or() -> TagQuery:
+        operands = [parse_and()]
+        while peek() == '|':
+            take()
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else TagGroup(TagOperation.OR, operands)
+
+    def parse_and() -> TagQuery:
+        operands = [parse_unary()]
+        while peek() not in (None, '|', ')'):
+            if peek() == '&':
+                take()
+            operands.append(parse_unary())
+        return operands[0] if len(operands) == 1 else TagGroup(TagOperation.AND, operands)
+
+    def parse_unary() -> TagQuery:
+        token = peek()
+        if token is None:
+            raise TagQuerySyntaxError("Неожиданный конец запроса")
+        take()
+        if token == '!':
+            return TagNot(parse_unary())
+        if token == '(':
+            operand = parse_or()
+            if peek() != ')':
+                raise TagQuerySyntaxError("Не хватает закрывающей скобки")
+            take()
+            return operand
+        if token in ('&', '|', ')'):
+            raise TagQuerySyntaxError(f"Неожиданный символ {token}")
+        return TagTerm(Tag(name=token))
+
+    query = parse_or()
+    if peek() is not None:
+        raise TagQuerySyntaxError(f"Неожиданный символ {peek()}")
+    return query
@@ -32,6 +32,11 @@ class TagBotUI(ChatUI):
         if has_tags:
             return "/add_tag", {"tag": tags}
         
+        if text[0] == "/get_messages":
+            # Всё после команды — запрос по тегам текущего чата
+            query = event.message.body.text.split(maxsplit=1)[1:]
+            return "/get_messages", {"chat_id": [event.get_ids()[0]], "q": query or [""]}
+
         if text[0].startswith("/"):
             route_name = text[0]
             args = {i: [v] for i, v in enumerate(text[1:])}
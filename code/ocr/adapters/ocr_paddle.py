@@ -1,26 +1,101 @@
+import logging
+
 from paddleocr import PaddleOCRVL
 from interfaces.ocr import *
 
+
+logger = logging.getLogger(__name__)
+
+
 class PaddleOCRManager(BaseOCRManager):
+    # Images that need to shrink by less than `max_downscale` go to the
+    # pipeline as a whole, downscaled to `tile_size` on the long side.
+    # Taller ones, e.g. long screenshots and document pages, are cut
+    # across into overlapping strips of `tile_size` rows, so text lines
+    # stay whole. Wider ones are downscaled as a whole: cutting them
+    # would split every line of text
+    tile_size = 1024
+    tile_overlap = 128
+    max_downscale = 2.0
+    max_tiles = 12
+    # Every image reaches the pipeline at most `tile_size` wide,
+    # so JPEGs are decoded directly at about that width
+    max_image_width = tile_size
+
     def __init__(self):
         self.pipeline = PaddleOCRVL(use_doc_unwarping=True)
 
-    def _resize_image(self, image: np.ndarray, max_dim: int = 1024) -> np.ndarray:
+    def _resize_image(self, image: np.ndarray, max_dim: Optional[int] = None) -> np.ndarray:
+        max_dim = max_dim or self.tile_size
         height, width = image.shape[:2]
         if max(height, width) > max_dim:
             scale = max_dim / max(height, width)
             new_size = (int(width * scale), int(height * scale))
             from cv2 import resize, INTER_AREA
-            print(f"Downsampling image from ({width}x{height}) → ({new_size})")
+            logger.debug("Downsampling image from (%dx%d) to %s", width, height, new_size)
             image = resize(image, new_size, interpolation=INTER_AREA)
         return image
 
+    def _covered(self, tiles: int) -> int:
+        """Length covered by `tiles` overlapping tiles in a column."""
+        return self.tile_size + (tiles - 1) * (self.tile_size - self.tile_overlap)
+
+    def _tile_starts(self, length: int) -> List[int]:
+        if length <= self.tile_size:
+            return [0]
+        step = self.tile_size - self.tile_overlap
+        return list(range(0, length - self.tile_size, step)) + [length - self.tile_size]
+
+    def _split_image(self, image: np.ndarray) -> List[np.ndarray]:
+        """
+        Return the image as it goes to the pipeline: whole, downscaled to
+        `tile_size` on the long side, or as strips from top to bottom,
+        `tile_size` wide and shrunk further only if there would be more
+        than `max_tiles` of them.
+        """
+        height, width = image.shape[:2]
+        if max(height, width) / self.tile_size <= self.max_downscale or height <= width:
+            return [self._resize_image(image)]
+
+        scale = min(1.0, self.tile_size / width, self._covered(self.max_tiles) / height)
+        if scale < 1:
+            image = self._resize_image(image, int(height * scale))
+            height, width = image.shape[:2]
+
+        starts = self._tile_starts(height)
+        logger.debug("Splitting image (%dx%d) into %d strips", width, height, len(starts))
+        return [image[top:top + self.tile_size] for top in starts]
+
+    @staticmethod
+    def _stitch(texts: List[str]) -> str:
+        """Join texts of consecutive tiles, dropping the lines repeated
+        because the tiles overlap."""
+        lines: List[str] = []
+        for text in texts:
+            tile_lines = text.splitlines()
+            overlap = 0
+            for n in range(min(len(lines), len(tile_lines)), 0, -1):
+                if [l.strip() for l in lines[-n:]] == [l.strip() for l in tile_lines[:n]]:
+                    overlap = n
+                    break
+            lines.extend(tile_lines[overlap:])
+        return "\n".join(lines)
+
     def get_image_transcription(self, image: np.ndarray) -> str:
-        print('Performing OCR on the image')
-        image = self._resize_image(image)
-        output = self.pipeline.predict(image, use_layout_detection=False,
+        return self.get_batch_transcription([image])[0]
+
+    def get_batch_transcription(self, images: List[np.ndarray]) -> List[str]:
+        logger.debug("Performing OCR on a batch of %d images", len(images))
+        split = [self._split_image(image) for image in images]
+        tiles = [tile for image_tiles in split for tile in image_tiles]
+        # Without layout detection the pipeline yields one result per input image,
+        # so tiles of all images go through it in one batch
+        output = self.pipeline.predict(tiles, use_layout_detection=False,
                                        prompt_label='ocr')
-        texts = []
-        for r in output:
-            texts.extend(r.markdown["markdown_texts"])
-        return "".join(texts)
+        texts = ["".join(r.markdown["markdown_texts"]) for r in output]
+
+        transcriptions = []
+        for image_tiles in split:
+            tile_texts, texts = texts[:len(image_tiles)], texts[len(image_tiles):]
+            transcriptions.append(self._stitch(tile_texts))
+        return transcriptions
@@ -0,0 +1,72 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Tuple
+
+import numpy as np
+
+from interfaces.ocr import BaseOCRManager
+
+
+class BatchingScheduler:
+    """
+    Collects images from concurrent request threads into batches for
+    `BaseOCRManager.get_batch_transcription`.
+
+    A batch is sent to the model once it has `max_batch` images or
+    `max_latency_ms` have passed since its first image arrived. A single
+    thread runs the model, so the manager is never called concurrently.
+    If a batch fails, its images are retried one by one so that one
+    broken image doesn't fail the others.
+    """
+    def __init__(self, ocr_manager: BaseOCRManager,
+                 max_batch: int = 8,
+                 max_latency_ms: float = 20):
+        self.ocr_manager = ocr_manager
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000
+        self._queue: queue.Queue[Tuple[np.ndarray, Future]] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def transcribe(self, image: np.ndarray) -> str:
+        """Queue an image and wait for its transcription."""
+        future: Future = Future()
+        self._queue.put((image, future))
+        return future.result()
+
+    def _collect_batch(self) -> List[Tuple[np.ndarray, Future]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect_batch()
+            try:
+                texts = self.ocr_manager.get_batch_transcription(
+                    [image for image, _ in batch])
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                else:
+                    self._run_one_by_one(batch)
+                continue
+            for (_, future), text in zip(batch, texts):
+                future.set_result(text)
+
+    def _run_one_by_one(self, batch: List[Tuple[np.ndarray, Future]]) -> None:
+        for image, future in batch:
+            try:
+                future.set_result(self.ocr_manager.get_image_transcription(image))
+            except Exception as e:
+                future.set_exception(e)
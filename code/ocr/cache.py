@@ -0,0 +1,195 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+_COUNTERS = ('url_hits', 'content_hits', 'persistent_hits', 'misses')
+
+class LRUTier:
+    """Bounded in-memory tier, safe to use from Flask request threads."""
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class SQLiteTier:
+    """
+    Persistent tier in a SQLite file. Every OCR worker process pointing
+    at the same file shares its results and hit/miss counters.
+
+    Entries not read for `ttl` seconds expire, and at most `max_entries`
+    are kept: the least recently used ones are evicted first.
+    """
+    def __init__(self, path: str, max_entries: int = 100000, ttl: Optional[float] = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr_cache "
+                         "(key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            # Файлы, созданные до вытеснения, не содержат этого столбца
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(ocr_cache)")}
+            if "accessed_at" not in existing:
+                conn.execute("ALTER TABLE ocr_cache ADD COLUMN accessed_at REAL NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ocr_cache_accessed_at "
+                         "ON ocr_cache (accessed_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr_cache_stats "
+                         "(name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("UPDATE ocr_cache SET accessed_at = ? WHERE key = ? "
+                               "AND accessed_at >= ? RETURNING value",
+                               (now, key, now - self.ttl if self.ttl else 0)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO ocr_cache (key, value, accessed_at) "
+                         "VALUES (?, ?, ?)", (key, value, now))
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl:
+            conn.execute("DELETE FROM ocr_cache WHERE accessed_at < ?", (now - self.ttl,))
+        # Puts are rare next to OCR itself, so the index walk on each one is cheap
+        conn.execute("DELETE FROM ocr_cache WHERE key IN (SELECT key FROM ocr_cache "
+                     "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def add_counts(self, counts: Dict[str, int]) -> None:
+        """Add the given amounts to the shared counters in one transaction."""
+        with self._connect() as conn:
+            conn.executemany("INSERT INTO ocr_cache_stats (name, value) VALUES (?, ?) "
+                             "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                             counts.items())
+
+    def counters(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT name, value FROM ocr_cache_stats").fetchall())
+
+
+class OCRResultCache:
+    """
+    Caches transcriptions by image content hash, with image URLs
+    mapped to content hashes as a pre-check that saves the download.
+
+    Keys are prefixed with `namespace`, so results of different OCR
+    managers never mix. Lookups go to the in-memory tier first and
+    then to the optional persistent tier, which refills memory on a hit.
+
+    Hit/miss counters live in the persistent tier, so `stats` covers all
+    worker processes sharing it; without one they are per process.
+    Lookups only count in memory, the counts are added to the persistent
+    tier at most every `stats_flush_interval` seconds and on `stats`.
+    """
+    def __init__(self, namespace: str,
+                 max_size: int = 1024,
+                 db_path: Optional[str] = None,
+                 db_max_entries: int = 100000,
+                 db_ttl: Optional[float] = None,
+                 stats_flush_interval: float = 10.0):
+        self.namespace = namespace
+        self.memory = LRUTier(max_size)
+        self.persistent = SQLiteTier(db_path, db_max_entries, db_ttl) if db_path else None
+        self.stats_flush_interval = stats_flush_interval
+        # С постоянным кэшем здесь только ещё не записанные в него счётчики
+        self._stats = dict.fromkeys(_COUNTERS, 0)
+        self._stats_lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self._stats[name] += 1
+            due = (self.persistent is not None and
+                   time.monotonic() - self._flushed_at >= self.stats_flush_interval)
+        if due:
+            self._flush_stats()
+
+    def _flush_stats(self) -> None:
+        with self._stats_lock:
+            counts = {name: value for name, value in self._stats.items() if value}
+            self._stats = dict.fromkeys(_COUNTERS, 0)
+            self._flushed_at = time.monotonic()
+        if not counts:
+            return
+        try:
+            self.persistent.add_counts(counts)
+        except Exception:
+            # Не теряем счётчики, запишутся при следующей попытке
+            with self._stats_lock:
+                for name, value in counts.items():
+                    self._stats[name] += value
+            raise
+
+    def _get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            value = self.persistent.get(key)
+            if value is not None:
+                self._count('persistent_hits')
+                self.memory.put(key, value)
+        return value
+
+    def _put(self, key: str, value: str) -> None:
+        self.memory.put(key, value)
+        if self.persistent is not None:
+            self.persistent.put(key, value)
+
+    def content_key(self, content: bytes) -> str:
+        return f"{self.namespace}:sha256:{hashlib.sha256(content).hexdigest()}"
+
+    def get_by_url(self, url: str) -> Optional[str]:
+        """Return the cached transcription of an already seen image URL."""
+        content_key = self._get(f"{self.namespace}:url:{url}")
+        text = self._get(content_key) if content_key is not None else None
+        if text is not None:
+            self._count('url_hits')
+        return text
+
+    def get_by_content(self, content_key: str) -> Optional[str]:
+        """Return the cached transcription of an image with this content key."""
+        text = self._get(content_key)
+        self._count('content_hits' if text is not None else 'misses')
+        return text
+
+    def put(self, content_key: str, text: str, url: Optional[str] = None) -> None:
+        """Store a transcription and, if given, the URL it was downloaded from."""
+        self._put(content_key, text)
+        if url is not None:
+            self._put(f"{self.namespace}:url:{url}", content_key)
+
+    def stats(self) -> Dict[str, float]:
+        stats: Dict[str, float] = dict.fromkeys(_COUNTERS, 0)
+        if self.persistent is not None:
+            self._flush_stats()
+            stats.update(self.persistent.counters())
+        else:
+            with self._stats_lock:
+                stats.update(self._stats)
+        lookups = stats['url_hits'] + stats['content_hits'] + stats['misses']
+        stats['hit_rate'] = (lookups - stats['misses']) / lookups if lookups else 0.0
+        return stats
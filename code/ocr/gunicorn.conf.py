@@ -0,0 +1,26 @@
+# Production serving: a pre-fork pool of worker processes,
+# each one loading its own OCR pipeline before it accepts requests.
+# Idle workers pick up new connections from the shared listening socket.
+import os
+
+bind = "0.0.0.0:5000"
+
+# One worker per available core by default. Each worker holds a full
+# copy of the model, so GPU deployments should set OCR_WORKERS explicitly.
+workers = int(os.environ.get("OCR_WORKERS", len(os.sched_getaffinity(0))))
+
+# Request threads inside a worker feed its batching scheduler
+worker_class = "gthread"
+threads = int(os.environ.get("OCR_THREADS", "8"))
+
+# Recycle workers to cap memory growth of the inference pipeline
+max_requests = int(os.environ.get("OCR_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+# Model loading and the first inference can take a while
+timeout = int(os.environ.get("OCR_WORKER_TIMEOUT", "300"))
+
+
+def post_worker_init(worker):
+    import server
+    server.init_app()
@@ -0,0 +1,141 @@
+import io
+import math
+import os
+import threading
+from typing import BinaryIO, Optional, Tuple, Union
+
+import numpy as np
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+
+MAX_IMAGE_BYTES = int(os.environ.get("OCR_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+CHUNK_SIZE = 64 * 1024
+# Enough to tell every format below apart, WEBP is the longest
+SNIFF_BYTES = 12
+
+# Magic numbers of formats PIL can decode
+_SIGNATURES = (
+    b"\xff\xd8\xff",            # JPEG
+    b"\x89PNG\r\n\x1a\n",       # PNG
+    b"GIF87a", b"GIF89a",       # GIF
+    b"BM",                      # BMP
+    b"II*\x00", b"MM\x00*",     # TIFF
+)
+
+# Decoded pixels of each request thread, reused from image to image
+_buffers = threading.local()
+
+# Shared by all request threads, keeps connections to the CDN alive
+_http = requests.Session()
+_http.mount("http://", HTTPAdapter(pool_maxsize=32))
+_http.mount("https://", HTTPAdapter(pool_maxsize=32))
+
+
+class ImageRejectedError(ValueError):
+    """Indicates that the given data is not an acceptable image."""
+    pass
+
+
+def _looks_like_image(head: bytes) -> bool:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return True
+    return head.startswith(_SIGNATURES)
+
+
+def check_image_bytes(content: bytes, max_bytes: int = MAX_IMAGE_BYTES) -> None:
+    """Reject uploaded data that is too large or not an image."""
+    if len(content) > max_bytes:
+        raise ImageRejectedError(f"Image is larger than {max_bytes} bytes")
+    if not _looks_like_image(content[:16]):
+        raise ImageRejectedError("Unknown image format")
+
+
+def download_image(url: str, max_bytes: int = MAX_IMAGE_BYTES) -> bytes:
+    """
+    Download an image, rejecting it as early as possible: by declared
+    type and size, then by the magic number in the first `SNIFF_BYTES`,
+    then as soon as the body grows over `max_bytes`.
+    """
+    with _http.get(url, stream=True, timeout=10) as response:
+        response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        if content_type and not content_type.startswith(("image/", "application/octet-stream")):
+            raise ImageRejectedError(f"Not an image: {content_type}")
+        content_length = response.headers.get("Content-Length")
+        if content_length and int(content_length) > max_bytes:
+            raise ImageRejectedError(f"Image is larger than {max_bytes} bytes")
+
+        content = bytearray()
+        sniffed = False
+        for chunk in response.iter_content(CHUNK_SIZE):
+            content += chunk
+            if not sniffed and len(content) >= SNIFF_BYTES:
+                if not _looks_like_image(content[:SNIFF_BYTES]):
+                    raise ImageRejectedError("Unknown image format")
+                sniffed = True
+            if len(content) > max_bytes:
+                raise ImageRejectedError(f"Image is larger than {max_bytes} bytes")
+    if not sniffed and not _looks_like_image(bytes(content)):
+        raise ImageRejectedError("Unknown image format")
+    return bytes(content)
+
+
+def _pixel_buffer(shape: Tuple[int, ...]) -> np.ndarray:
+    """Array of `shape` over this thread's pixel buffer, which only grows."""
+    size = math.prod(shape)
+    buffer = getattr(_buffers, "pixels", None)
+    if buffer is None or buffer.size < size:
+        buffer = _buffers.pixels = np.empty(size, dtype=np.uint8)
+    return buffer[:size].reshape(shape)
+
+
+def _copy_pixels(image: Image.Image, out: np.ndarray) -> None:
+    # Как Image.tobytes, но по частям сразу в буфер, без копии всего изображения
+    image.load()
+    encoder = Image._getencoder(image.mode, "raw", image.mode)
+    encoder.setimage(image.im, (0, 0) + image.size)
+    flat = out.reshape(-1)
+    offset = 0
+    while True:
+        _, errcode, data = encoder.encode(max(CHUNK_SIZE, image.width * 4))
+        flat[offset:offset + len(data)] = np.frombuffer(data, dtype=np.uint8)
+        offset += len(data)
+        if errcode:
+            break
+    if errcode < 0:
+        raise ImageRejectedError(f"Failed to read decoded pixels (error {errcode})")
+
+
+def decode_image(data: Union[bytes, memoryview, BinaryIO],
+                 max_width: Optional[int] = None) -> np.ndarray:
+    """
+    Decode an image into an RGB array. With `max_width` JPEGs are decoded
+    in draft mode at the smallest DCT scale that still keeps the width
+    at least `max_width`, so a 12 MP photo isn't fully decoded only
+    to be downsampled afterwards.
+
+    Pixels go straight into a buffer of the calling thread that is
+    reused by its next decode, so no array is allocated per image. The
+    result is writable, but only valid until the thread decodes another
+    image: request threads block on the transcription before that.
+    """
+    stream = data if hasattr(data, "read") else io.BytesIO(data)
+    image = Image.open(stream)
+    if max_width is not None and image.format == "JPEG":
+        width, height = image.size
+        scale = max_width / width
+        if scale < 1:
+            image.draft("RGB", (int(width * scale), int(height * scale)))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    out = _pixel_buffer((image.height, image.width, 3))
+    _copy_pixels(image, out)
+    return out
+
+
+def convert_to_numpy(image_stream_or_url, max_width: Optional[int] = None) -> np.ndarray:
+    if isinstance(image_stream_or_url, str):  # URL
+        return decode_image(download_image(image_stream_or_url), max_width)
+    return decode_image(image_stream_or_url, max_width)
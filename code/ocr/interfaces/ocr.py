@@ -1,8 +1,18 @@
 from abc import ABC, abstractmethod
+from typing import List, Optional
 import numpy as np
 
 class BaseOCRManager(ABC):
+    # Widest image the manager works with, None if it takes any size.
+    # Lets the server decode large images directly at a lower resolution.
+    max_image_width: Optional[int] = None
+
     @abstractmethod
     def get_image_transcription(self, image: np.ndarray) -> str:
         """Extract and return text from the given image."""
-        pass
\ No newline at end of file
+        pass
+
+    def get_batch_transcription(self, images: List[np.ndarray]) -> List[str]:
+        """Extract text from several images at once, in the same order.
+        Managers that can run a real batch should override it."""
+        return [self.get_image_transcription(image) for image in images]
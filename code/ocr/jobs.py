@@ -0,0 +1,228 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = {
+    "priority": "INTEGER NOT NULL DEFAULT 0",
+    "image_url": "TEXT",
+    "callback_url": "TEXT",
+    "worker_pid": "INTEGER",
+    "attempts": "INTEGER NOT NULL DEFAULT 0",
+    "lease_until": "REAL",
+    "created_at": "REAL",
+}
+
+
+class CallbackNotAllowedError(ValueError):
+    """Indicates that a callback URL points to a host outside the allowlist."""
+    pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    Job queue and job states in a SQLite file. Gunicorn workers of one
+    container share it: any worker can take a queued job, and a job can
+    be polled through any worker, not only the one that runs it.
+
+    A claimed job is leased to its worker for `lease` seconds, so a job
+    whose worker was recycled or crashed is taken again by another one,
+    at most `max_attempts` times. Jobs nobody took within `ttl` seconds
+    expire, finished jobs are kept for `ttl` seconds for late pollers.
+    """
+    def __init__(self, path: str, ttl: float = 3600, lease: float = 300,
+                 max_attempts: int = 3):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr_job "
+                         "(id TEXT PRIMARY KEY, status TEXT NOT NULL, "
+                         "text TEXT, error TEXT, updated_at REAL NOT NULL)")
+            # Files created before the store became a queue lack these columns
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(ocr_job)")}
+            for name, definition in _COLUMNS.items():
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE ocr_job ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_ocr_job_queue "
+                         "ON ocr_job (status, priority DESC, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    def create(self, job_id: str, image_url: str, priority: int = 0,
+               callback_url: Optional[str] = None) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            self._expire(conn, now)
+            conn.execute("INSERT INTO ocr_job (id, status, priority, image_url, callback_url, "
+                         "created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                         (job_id, priority, image_url, callback_url, now, now))
+
+    def _expire(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM ocr_job WHERE status IN ('done', 'failed') "
+                     "AND updated_at < ?", (now - self.ttl,))
+        conn.execute("UPDATE ocr_job SET status = 'failed', error = 'Job expired', "
+                     "updated_at = ? WHERE status IN ('queued', 'running') "
+                     "AND created_at < ?", (now, now - self.ttl))
+
+    def claim(self) -> Optional[Dict]:
+        """
+        Atomically take the next job: the highest priority queued job, or
+        a running one whose lease has expired. Returns None if there is none.
+        The returned `attempt` has to be passed to `update`.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # Простой опрос только читает: в WAL это не блокирует запись
+            candidate = conn.execute(
+                "SELECT 1 FROM ocr_job WHERE status = 'queued' "
+                "OR (status = 'running' AND lease_until < ?) LIMIT 1", (now,)).fetchone()
+            if candidate is None:
+                return None
+            # Задачи, исчерпавшие попытки, больше не берутся
+            conn.execute("UPDATE ocr_job SET status = 'failed', "
+                         "error = 'Worker lost while running the job', updated_at = ? "
+                         "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            row = conn.execute(
+                "UPDATE ocr_job SET status = 'running', worker_pid = ?, "
+                "attempts = attempts + 1, lease_until = ?, updated_at = ? "
+                "WHERE id = (SELECT id FROM ocr_job "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY priority DESC, created_at LIMIT 1) "
+                "RETURNING id, image_url, callback_url, attempts",
+                (os.getpid(), now + self.lease, now, now)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "image_url": row[1], "callback_url": row[2], "attempt": row[3]}
+
+    def recover(self) -> int:
+        """
+        Requeue running jobs of worker processes that are gone, or fail
+        them if they are out of attempts. Returns the number of jobs requeued.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, worker_pid, attempts FROM ocr_job "
+                                "WHERE status = 'running'").fetchall()
+            lost = [(job_id, attempts) for job_id, pid, attempts in rows
+                    if pid is None or not _pid_alive(pid)]
+            requeued = [job_id for job_id, attempts in lost if attempts < self.max_attempts]
+            failed = [job_id for job_id, attempts in lost if attempts >= self.max_attempts]
+            conn.executemany("UPDATE ocr_job SET status = 'queued', worker_pid = NULL, "
+                             "lease_until = NULL, updated_at = ? WHERE id = ?",
+                             [(now, job_id) for job_id in requeued])
+            conn.executemany("UPDATE ocr_job SET status = 'failed', "
+                             "error = 'Worker lost while running the job', updated_at = ? "
+                             "WHERE id = ?", [(now, job_id) for job_id in failed])
+        return len(requeued)
+
+    def update(self, job_id: str, attempt: int, status: str,
+               text: Optional[str] = None, error: Optional[str] = None) -> bool:
+        """
+        Finish the `attempt` run of a job. Only the run that holds the
+        job's current lease may do so: a run whose lease expired and whose
+        job was claimed again writes nothing. Returns whether it was updated.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute("UPDATE ocr_job SET status = ?, text = ?, error = ?, "
+                                  "updated_at = ? WHERE id = ? AND status = 'running' "
+                                  "AND attempts = ?",
+                                  (status, text, error, time.time(), job_id, attempt))
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT id, status, text, error FROM ocr_job WHERE id = ?",
+                               (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {"id": row[0], "status": row[1]}
+        if row[2] is not None:
+            job["text"] = row[2]
+        if row[3] is not None:
+            job["error"] = row[3]
+        return job
+
+
+class JobQueue:
+    """
+    Runs OCR jobs from a `JobStore` on `workers` threads in priority
+    order: higher `priority` first, submission order within the same
+    priority, across all processes sharing the store. When a job
+    finishes its state is POSTed to its callback URL, if any; callbacks
+    are only allowed to hosts in `callback_hosts`.
+    """
+    def __init__(self, handler: Callable[[str], str], store: JobStore, workers: int = 4,
+                 callback_hosts: Iterable[str] = (), poll_interval: float = 0.5):
+        self.handler = handler
+        self.store = store
+        self.callback_hosts = frozenset(callback_hosts)
+        self.poll_interval = poll_interval
+        # Wakes local workers at once, jobs of other processes are found by polling
+        self._wakeup = threading.Event()
+        requeued = self.store.recover()
+        if requeued:
+            logger.warning("Requeued %d jobs of lost OCR workers", requeued)
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._run, daemon=True) for _ in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image_url: str, priority: int = 0,
+               callback_url: Optional[str] = None) -> str:
+        if callback_url is not None and urlparse(callback_url).hostname not in self.callback_hosts:
+            raise CallbackNotAllowedError(f"Callbacks to {callback_url} are not allowed")
+        job_id = uuid.uuid4().hex
+        self.store.create(job_id, image_url, priority, callback_url)
+        self._wakeup.set()
+        return job_id
+
+    def _run(self) -> None:
+        while True:
+            # Cleared before looking for jobs, so a submit in between isn't lost
+            self._wakeup.clear()
+            job = self.store.claim()
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                finished = self.store.update(job["id"], job["attempt"], "done",
+                                             text=self.handler(job["image_url"]))
+            except Exception as e:
+                finished = self.store.update(job["id"], job["attempt"], "failed",
+                                             error=str(e))
+            if not finished:
+                logger.warning("Lease of OCR job %s expired, its result is dropped", job["id"])
+                continue
+            if job["callback_url"]:
+                self._notify(job["callback_url"], self.store.get(job["id"]))
+
+    def _notify(self, callback_url: str, job: Dict) -> None:
+        try:
+            requests.post(callback_url, json=job, timeout=10, allow_redirects=False)
+        except requests.RequestException as e:
+            logger.warning("Callback to %s failed: %s", callback_url, e)
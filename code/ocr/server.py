@@ -1,22 +1,38 @@
 from flask import Flask, request, jsonify
-import io
-import numpy as np
-from PIL import Image
-import requests
 import os
 
+from cache import OCRResultCache
+from images import (ImageRejectedError, MAX_IMAGE_BYTES,
+                    check_image_bytes, download_image, convert_to_numpy)
+from batching import BatchingScheduler
+from jobs import CallbackNotAllowedError, JobQueue, JobStore
+
 app = Flask(__name__)
+# Leaves room for multipart headers, the image itself is checked separately
+app.config["MAX_CONTENT_LENGTH"] = MAX_IMAGE_BYTES + 64 * 1024
 ocr_manager = None
+result_cache: OCRResultCache = None
+batcher: BatchingScheduler = None
+job_queue: JobQueue = None
+
+def transcribe_url(image_url):
+    # The same image is often OCR'd again from other chats,
+    # a known URL lets us skip even the download
+    text = result_cache.get_by_url(image_url)
+    if text is not None:
+        return text
 
-def convert_to_numpy(image_stream_or_url):
-    if isinstance(image_stream_or_url, str):  # URL
-        response = requests.get(image_stream_or_url, timeout=10)
-        response.raise_for_status()
-        image = Image.open(io.BytesIO(response.content)).convert("RGB")
-    else:  
-        image = Image.open(image_stream_or_url).convert("RGB")
+    return transcribe_bytes(download_image(image_url), image_url=image_url)
 
-    return np.array(image)
+
+def transcribe_bytes(content, image_url=None):
+    content_key = result_cache.content_key(content)
+    text = result_cache.get_by_content(content_key)
+    if text is None:
+        # bytes go to the decoder as they are, BytesIO shares their buffer
+        text = batcher.transcribe(convert_to_numpy(content, max_width=ocr_manager.max_image_width))
+    result_cache.put(content_key, text, url=image_url)
+    return text
 
 
 @app.route("/ocr", methods=["POST"])
@@ -30,9 +46,9 @@ def ocr_endpoint():
     image_url = data["image"]
 
     try:
-        image_np = convert_to_numpy(image_url)
-        # text = None
-        text = ocr_manager.get_image_transcription(image_np)
+        text = transcribe_url(image_url)
+    except ImageRejectedError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -40,16 +56,89 @@ def ocr_endpoint():
         "text": text
     })
     
+@app.route("/ocr/upload", methods=["POST"])
+def ocr_upload_endpoint():
+    # multipart/form-data with an `image` file or a raw application/octet-stream body
+    if "image" in request.files:
+        content = request.files["image"].read()
+    elif request.mimetype == "application/octet-stream":
+        content = request.get_data(cache=False)
+    else:
+        return jsonify({"error": "No image provided"}), 400
+
+    try:
+        check_image_bytes(content)
+        text = transcribe_bytes(content)
+    except ImageRejectedError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    return jsonify({
+        "text": text
+    })
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    data = request.get_json(silent=True)
+    if not data or "image" not in data:
+        return jsonify({"error": "No image URL provided"}), 400
+
+    try:
+        job_id = job_queue.submit(data["image"],
+                                  priority=int(data.get("priority", 0)),
+                                  callback_url=data.get("callback_url"))
+    except CallbackNotAllowedError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"id": job_id, "status": "queued"}), 202
+
+
+@app.route("/jobs/<job_id>")
+def get_job(job_id):
+    job = job_queue.store.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+
 @app.route("/health")
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
 
-if __name__ == "__main__":
+@app.route("/metrics")
+def metrics():
+    return jsonify({"cache": result_cache.stats()}), 200
+
+
+def init_app():
+    """Load the OCR model and set up the cache and the batching scheduler.
+    Called once per process: by `__main__` for the dev server and
+    by `gunicorn.conf.py` in every pre-forked worker."""
+    global ocr_manager, result_cache, batcher, job_queue
     if os.environ.get("USE_STUB_OCR") == "true":
         from adapters.ocr_stub import StubOCRManager
         ocr_manager = StubOCRManager()
     else:
         from adapters.ocr_paddle import PaddleOCRManager
         ocr_manager = PaddleOCRManager()
+    result_cache = OCRResultCache(namespace=type(ocr_manager).__name__,
+                                  max_size=int(os.environ.get("OCR_CACHE_SIZE", "1024")),
+                                  db_path=os.environ.get("OCR_CACHE_DB"),
+                                  db_max_entries=int(os.environ.get("OCR_CACHE_DB_SIZE", "100000")),
+                                  db_ttl=float(os.environ.get("OCR_CACHE_DB_TTL", "0")) or None,
+                                  stats_flush_interval=float(os.environ.get("OCR_CACHE_STATS_FLUSH", "10")))
+    batcher = BatchingScheduler(ocr_manager,
+                                max_batch=int(os.environ.get("OCR_MAX_BATCH", "8")),
+                                max_latency_ms=float(os.environ.get("OCR_MAX_BATCH_LATENCY_MS", "20")))
+    job_queue = JobQueue(transcribe_url,
+                         JobStore(os.environ.get("OCR_JOBS_DB", "/tmp/ocr-jobs.sqlite3")),
+                         workers=int(os.environ.get("OCR_JOB_WORKERS", "4")),
+                         callback_hosts=[host for host in
+                                         os.environ.get("OCR_CALLBACK_HOSTS", "").split(",") if host])
+
+
+if __name__ == "__main__":
+    init_app()
     app.run(host="0.0.0.0", port=5000, debug=False)